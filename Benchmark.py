@@ -0,0 +1,132 @@
+import os
+import glob
+import json
+import shutil
+import tempfile
+import argparse
+import timeit
+import numpy as np
+from ScriptSampler import Data, Script, WeightedSampleFromDict, WeightedSampler
+from ScriptCatalog import SanitizeName
+from ScriptPdf import ScriptPdf
+from ScriptNamer import ScriptNamer
+
+# e.g. python Benchmark.py --scale 10 100
+# timings are the best of a few repeats, per call
+
+teamSizesList = [
+	{"townsfolk" : 7, "outsider" : 2, "minion" : 2, "demon" : 1},
+	{"townsfolk" : 13, "outsider" : 4, "minion" : 4, "demon" : 4},
+	{"townsfolk" : 18, "outsider" : 6, "minion" : 6, "demon" : 6},
+]
+stepsList = [100, 500, 1000]
+
+def TimePerCall(f, n, repeat=5):
+	return min(timeit.repeat(f, number=n, repeat=repeat)) / n
+
+def Report(name, seconds):
+	if seconds >= 1:
+		print("  %-44s %8.2f s" % (name, seconds))
+	elif seconds >= 1e-3:
+		print("  %-44s %8.2f ms" % (name, 1e3 * seconds))
+	else:
+		print("  %-44s %8.2f us" % (name, 1e6 * seconds))
+
+def SyntheticCorpus(srcPath, dstPath, factor, seed=0):
+	# a data dir with factor perturbed copies of each script in srcPath, each role swapped for a random one of its team w.p. 0.1
+	rng = np.random.default_rng(seed)
+	inputData = Data(srcPath)
+	shutil.copytree(os.path.join(srcPath, "official"), os.path.join(dstPath, "official"))
+	shutil.copy(os.path.join(srcPath, "hardRestrictions.json"), dstPath)
+	os.makedirs(os.path.join(dstPath, "scripts"))
+	for fileName in sorted(glob.glob(os.path.join(srcPath, "scripts", "*.json"))):
+		try:
+			with open(fileName) as j:
+				roles = [SanitizeName(role["id"]) for role in json.load(j)]
+		except:
+			continue
+		roles = [role for role in roles if role in inputData.rolesInv]
+		for k in range(factor):
+			script = [role if rng.random() > 0.1 else rng.choice(inputData.teams[inputData.roleTeams[role]]) for role in roles]
+			name = "%s_%d.json" % (os.path.splitext(os.path.basename(fileName))[0], k)
+			with open(os.path.join(dstPath, "scripts", name), "w") as j:
+				json.dump([{"id" : str(role)} for role in script], j)
+	return dstPath
+
+def BenchDataInit(path, n=3):
+	print("Data(%s), %d scripts:" % (path, len(glob.glob(os.path.join(path, "scripts", "*.json")))))
+	Report("uncached", TimePerCall(lambda: Data(path, useCache=False), 1, n))
+	Data(path) # make sure the cache exists
+	Report("cached", TimePerCall(lambda: Data(path), 1, n))
+	# the stats are written into a copy, so path/stats is left alone
+	with tempfile.TemporaryDirectory() as tmpDir:
+		statsPath = os.path.join(tmpDir, "data")
+		shutil.copytree(path, statsPath, ignore=shutil.ignore_patterns("stats"))
+		os.makedirs(os.path.join(statsPath, "stats"))
+		Report("cached + WriteStats", TimePerCall(lambda: Data(statsPath).WriteStats(), 1, n))
+		shutil.rmtree(os.path.join(statsPath, "stats"))
+		Report("cached + UpdateStats, first write", TimePerCall(lambda: Data(statsPath).UpdateStats(), 1, 1))
+		Report("cached + UpdateStats, up to date", TimePerCall(lambda: Data(statsPath).UpdateStats(), 1, n))
+
+def BenchScripts(inputData, n=3):
+	print("Script generation:")
+	for teamSizes in teamSizesList:
+		for steps in stepsList:
+			name = "%s, %d steps" % ("/".join(str(k) for k in teamSizes.values()), steps)
+			Report(name, TimePerCall(lambda: Script(inputData, teamSizes, seed=0, steps=steps), 1, n))
+
+def BenchStep(inputData, n=1000):
+	print("Script.Step:")
+	for teamSizes in teamSizesList:
+		script = Script(inputData, teamSizes, seed=0, build=False)
+		Report("/".join(str(k) for k in teamSizes.values()), TimePerCall(script.Step, n))
+
+def BenchPdf(inputData, path, n=3):
+	print("ScriptPdf:")
+	toolScript = Script(inputData, teamSizesList[1], seed=0, steps=100).ToolScript()
+	scriptPdf = ScriptPdf(path, cacheSize=0) # every call renders
+	Report("PdfAsBytes, rendered", TimePerCall(lambda: scriptPdf.PdfAsBytes(toolScript, "Benchmark Script"), 1, n))
+	scriptPdf = ScriptPdf(path)
+	scriptPdf.PdfAsBytes(toolScript, "Benchmark Script")
+	Report("PdfAsBytes, cache hit", TimePerCall(lambda: scriptPdf.PdfAsBytes(toolScript, "Benchmark Script"), 1, n))
+
+def BenchNames(n=1000):
+	print("ScriptNamer:")
+	scriptNamer = ScriptNamer("english")
+	Report("SampleNames", TimePerCall(scriptNamer.SampleNames, n))
+
+def BenchWeightedSampling(inputData, n=20000):
+	# per-draw cost of the dict-based sampler vs the cached inverse-CDF sampler
+	rng = np.random.default_rng(0)
+	teamSizes = {"townsfolk" : 13, "outsider" : 4, "minion" : 4, "demon" : 4}
+	roleWeights = rng.random(60)
+	candidates = np.arange(60)
+	teamSampler = WeightedSampler(list(teamSizes.keys()), list(teamSizes.values()))
+	saoSampler = WeightedSampler(list(inputData.saoDist.keys()), list(inputData.saoDist.values()))
+	print("Weighted sampling:")
+	Report("team sizes, WeightedSampleFromDict", TimePerCall(lambda: WeightedSampleFromDict(teamSizes, rng), n))
+	Report("team sizes, WeightedSampler", TimePerCall(lambda: teamSampler.Sample(rng), n))
+	Report("saoDist, WeightedSampleFromDict", TimePerCall(lambda: WeightedSampleFromDict(inputData.saoDist, rng), n))
+	Report("saoDist, WeightedSampler", TimePerCall(lambda: saoSampler.Sample(rng), n))
+	Report("60 role weights, rng.choice(p=...)", TimePerCall(lambda: rng.choice(candidates, p=roleWeights/np.sum(roleWeights)), n))
+	Report("60 role weights, WeightedSampler", TimePerCall(lambda: WeightedSampler(candidates, roleWeights).Sample(rng), n))
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser()
+	parser.add_argument("--path", default="public")
+	parser.add_argument("--scale", type=int, nargs="*", default=[], help="also benchmark on synthetic corpora this many times bigger")
+	args = parser.parse_args()
+
+	inputData = Data(args.path)
+	BenchDataInit(args.path)
+	BenchScripts(inputData)
+	BenchStep(inputData)
+	BenchPdf(inputData, args.path)
+	BenchNames()
+	BenchWeightedSampling(inputData)
+
+	for factor in args.scale:
+		with tempfile.TemporaryDirectory() as tmpDir:
+			path = SyntheticCorpus(args.path, os.path.join(tmpDir, "x%d" % factor), factor)
+			BenchDataInit(path, n=1)
+			BenchScripts(Data(path), n=1)
@@ -0,0 +1,118 @@
+# license: GPL v3
+import json
+import os
+import hashlib
+import threading
+
+def SanitizeName(s):
+	# convert role["name"] into the roleId used by the script tool (which is not equal to role["id"] ffs)
+	s = s.lower()
+	s = s.replace(' ', '_')
+	s = s.replace("'","")
+	if s == "mephit":
+		s = "mezepheles"
+	s = s.strip()
+	return s
+
+def SanitizeText(s):
+	# remove non-pdf-able characters
+	s = s.replace("“", "'")
+	s = s.replace("”", "'")
+	s = s.replace("’","'")
+	s = s.replace("−","-")
+	s.strip()
+	return s
+
+# a version of Standard "Amy" Order
+standardAmyOrder = [
+	"you start",
+	"each night,",
+	"each night*",
+	"each day",
+	"once per game, at night,",
+	"once per game, at night*",
+	"once per game, during the day",
+	"once per game",
+	"on your 1st night",
+	"on your 1st day",
+	"when",
+	"if you",
+	"if",
+	"you",
+]
+
+def SAO(_s):
+	s = _s.lower()
+	for i,prefix in enumerate(standardAmyOrder):
+		if s.startswith(prefix):
+			return i
+	return len(standardAmyOrder)
+
+class RoleCatalog:
+	# everything about the official roles & jinxes, parsed from roles.json & hatred.json once and shared by Data & ScriptPdf
+	teamNames = ["townsfolk", "outsider", "minion", "demon"] # the teams scripts are sampled from
+
+	def __init__(self, path):
+		self.path = path
+		self.roleInfo = {} # role -> role dict from roles.json, with pdf-able texts
+		self.roleSAOs = {} # role -> saoClass
+		self.roleTeams = {} # role -> team
+		self.sampledRoles = [] # roles of teamNames, ordered by team then SAO class
+		self.jinxes = [] # [(role1, role2)], in hatred.json order
+		self.jinxReasons = {} # (role1, role2) -> (position in hatred.json, name1, name2, reason)
+
+		h = hashlib.sha256() # of the input files, for caches of things made from them
+		with open(os.path.join(self.path, "official", "roles.json"), "rb") as j:
+			rolesBytes = j.read()
+		with open(os.path.join(self.path, "official", "hatred.json"), "rb") as j:
+			hatredBytes = j.read()
+		h.update(rolesBytes)
+		h.update(hatredBytes)
+		self.inputHash = h.hexdigest()
+
+		jsonRoles = json.loads(rolesBytes)
+		for role in jsonRoles:
+			roleId = SanitizeName(role["name"])
+			role["ability"] = SanitizeText(role["ability"])
+			role["firstNightReminder"] = SanitizeText(role["firstNightReminder"])
+			role["otherNightReminder"] = SanitizeText(role["otherNightReminder"])
+			self.roleInfo[roleId] = role
+
+		jsonRoles = sorted(jsonRoles, key=lambda x: SAO(x["ability"]))
+		jsonRoles = sorted(jsonRoles, key=lambda x: x["team"], reverse=True)
+		for role in jsonRoles:
+			if role["team"] not in self.teamNames:
+				continue
+			if role["id"] == "mephit":
+				continue # included with both names in roles.json
+			roleId = SanitizeName(role["name"])
+			self.sampledRoles.append(roleId)
+			self.roleSAOs[roleId] = SAO(role["ability"])
+			self.roleTeams[roleId] = role["team"]
+
+		for _jinx in json.loads(hatredBytes):
+			for jinx in _jinx["hatred"]:
+				role1 = SanitizeName(_jinx["id"])
+				role2 = SanitizeName(jinx["id"])
+				self.jinxReasons[(role1, role2)] = (len(self.jinxes), _jinx["id"], jinx["id"], jinx["reason"])
+				self.jinxes.append((role1, role2))
+
+	def JinxesAmong(self, roles):
+		# [(name1, name2, reason)] of the jinxes between these roles, in hatred.json order
+		roles = set(roles)
+		found = []
+		for role1 in roles:
+			for role2 in roles:
+				if (role1, role2) in self.jinxReasons:
+					found.append(self.jinxReasons[(role1, role2)])
+		return [jinx[1:] for jinx in sorted(found)]
+
+catalogs = {} # path -> RoleCatalog
+catalogsLock = threading.Lock()
+
+def GetCatalog(path):
+	# the RoleCatalog for a data dir, built on first use
+	with catalogsLock:
+		if path not in catalogs:
+			catalogs[path] = RoleCatalog(path)
+		return catalogs[path]
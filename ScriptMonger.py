@@ -1,9 +1,12 @@
 import os
 import sys
+import glob
 import random
 import numpy as np
 import io
 import json
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 
 import logging
 loggingMode = logging.INFO
@@ -26,10 +29,14 @@ from dotenv import load_dotenv
 load_dotenv()
 
 from ScriptSampler import Data, Script
+from ScriptProfile import Profile, Timer
 from ScriptPdf import ScriptPdf
 dataPath = "public"
 inputData = Data(dataPath)
-scriptPdf = ScriptPdf(dataPath)
+# rendered pdfs are cached, in memory & optionally on disk
+pdfCacheSize = int(os.getenv('SCRIPTMONGER_PDF_CACHE_SIZE', 32))
+pdfCacheDir = os.getenv('SCRIPTMONGER_PDF_CACHE_DIR') # unset for no disk cache
+scriptPdf = ScriptPdf(dataPath, cacheSize=pdfCacheSize, cacheDir=pdfCacheDir)
 
 from ScriptNamer import ScriptNamer
 scriptNamer = ScriptNamer("english")
@@ -42,6 +49,97 @@ defaultTeamSizes = {
 	"demon" : 4,
 }
 
+# script generation & pdf rendering are blocking, so they run in a bounded worker pool, off the event loop
+maxWorkers = int(os.getenv('SCRIPTMONGER_WORKERS', 2)) # total concurrent jobs
+maxGuildJobs = int(os.getenv('SCRIPTMONGER_GUILD_JOBS', 1)) # concurrent jobs per guild, the rest queue up
+executor = ThreadPoolExecutor(max_workers=maxWorkers)
+guildQueues = {} # guild id (or DM author) -> asyncio.Semaphore
+
+async def RunJob(message, job):
+	key = message.guild.id if message.guild else ("DM", message.author.id)
+	if key not in guildQueues:
+		guildQueues[key] = asyncio.Semaphore(maxGuildJobs)
+	async with guildQueues[key]:
+		return await asyncio.get_running_loop().run_in_executor(executor, job)
+
+# each new script is the best of a few chains, run in lockstep batches
+nChains = int(os.getenv('SCRIPTMONGER_CHAINS', 4))
+chainBatchSize = int(os.getenv('SCRIPTMONGER_CHAIN_BATCH', 2)) # chains per batch, the budget is checked between batches
+chainBudget = float(os.getenv('SCRIPTMONGER_CHAIN_BUDGET', 5.0)) # seconds, soft: a batch that has started is finished
+profiling = os.getenv('SCRIPTMONGER_PROFILE', '0') == '1' # log per phase timings of each \gen
+
+def NewScript(teamSizes, alpha, beta, gamma, requiredRoles=[], omittedRoles=[]):
+	seed = np.random.randint(10**4,10**5)
+	steps = np.random.randint(500,700)
+	return Script.GenerateBest(inputData, teamSizes, nChains, seed=seed, steps=steps, alpha=alpha, beta=beta, gamma=gamma, requiredRoles=requiredRoles, omittedRoles=omittedRoles, budget=chainBudget, batchSize=chainBatchSize, profile=profiling)
+
+# ready-made scripts for \gen requests without required/omitted roles, refilled in the background
+poolSize = int(os.getenv('SCRIPTMONGER_POOL_SIZE', 5)) # scripts kept per key
+poolKeys = int(os.getenv('SCRIPTMONGER_POOL_KEYS', 4)) # max number of keys, the default key included
+poolRefillDelay = float(os.getenv('SCRIPTMONGER_POOL_REFILL_DELAY', 2.0)) # seconds between refill passes
+poolStats = {"hits": 0, "misses": 0}
+refillTask = None
+
+def PoolKey(teamSizes, alpha, beta, gamma):
+	return (tuple(teamSizes[team] for team in defaultTeamSizes), alpha, beta, gamma)
+
+scriptPool = {PoolKey(defaultTeamSizes, 0.0, 1.0, 0.1): []} # (teamSizes, alpha, beta, gamma) -> [Script]
+
+async def RefillPool():
+	while True:
+		for key,scripts in list(scriptPool.items()):
+			if len(scripts) < poolSize:
+				sizes, alpha, beta, gamma = key
+				teamSizes = dict(zip(defaultTeamSizes, sizes))
+				try:
+					script = await asyncio.get_running_loop().run_in_executor(executor, NewScript, teamSizes, alpha, beta, gamma)
+				except Exception:
+					logging.exception("Failed to refill the script pool for %s" % str(key))
+					continue # the other keys, then this one again next time
+				if script.data is inputData: # else WatchScripts swapped the data while it was being sampled
+					scripts.append(script)
+		await asyncio.sleep(poolRefillDelay)
+
+# new, changed & deleted files in the scripts dir are picked up without a restart
+watchInterval = float(os.getenv('SCRIPTMONGER_WATCH_INTERVAL', 60)) # seconds, 0 disables
+watchTask = None
+
+def ScriptFileTimes():
+	fileTimes = {}
+	for f in glob.glob(os.path.join(dataPath, "scripts", "*.json")):
+		try:
+			fileTimes[f] = os.path.getmtime(f)
+		except OSError:
+			pass # deleted since the glob, it's picked up as removed
+	return fileTimes
+
+async def WatchScripts():
+	global inputData
+	fileTimes = ScriptFileTimes()
+	while True:
+		await asyncio.sleep(watchInterval)
+		newFileTimes = ScriptFileTimes()
+		changed = [f for f,t in newFileTimes.items() if fileTimes.get(f) != t]
+		removed = [f for f in fileTimes if f not in newFileTimes]
+		if len(changed) == 0 and len(removed) == 0:
+			continue
+		def UpdatedData():
+			newData = inputData.Copy()
+			newData.RemoveScripts(removed)
+			newData.AddScripts(changed)
+			return newData
+		# scripts already being generated keep the Data they started with, new ones get the updated copy
+		try:
+			inputData = await asyncio.get_running_loop().run_in_executor(executor, UpdatedData)
+		except Exception:
+			logging.exception("Failed to update input data, keeping the old data")
+			continue # and try these files again next time
+		fileTimes = newFileTimes
+		# pooled scripts were sampled from the old data
+		for scripts in scriptPool.values():
+			scripts.clear()
+		logging.info("Updated input data, %d scripts added/changed, %d removed" % (len(changed), len(removed)))
+
 import discord
 from discord.ext.commands import Bot
 from discord.ext import commands
@@ -54,6 +152,12 @@ async def on_ready():
 	logging.info('Logged in as {0.user}'.format(bot))
 	for guild in bot.guilds:
 		logging.info('Present in guild %s' % guild.name)
+	global refillTask
+	if refillTask is None and poolSize > 0:
+		refillTask = asyncio.create_task(RefillPool())
+	global watchTask
+	if watchTask is None and watchInterval > 0:
+		watchTask = asyncio.create_task(WatchScripts())
 
 @bot.event
 async def on_guild_join(guild):
@@ -90,6 +194,7 @@ async def on_message(message):
 		await message.channel.send(s)
 		return
 	elif m.startswith('\data'):
+		await asyncio.get_running_loop().run_in_executor(executor, inputData.UpdateStats) # only slow the first time
 		statsPath = os.path.join(dataPath, "stats")
 		await message.channel.send(content="heatmap of pairwise role frequencies", file=discord.File(fp=os.path.join(statsPath, "heatmap.png")))					
 		await message.channel.send(content="heatmap.xlsx (with role names)", file=discord.File(fp=os.path.join(statsPath, "heatmap.xlsx")))					
@@ -155,10 +260,24 @@ Stop after a few hundred iterations.
 			await message.channel.send("Invalid parameter '%s'" % token)
 			return
 
-	seed = np.random.randint(10**4,10**5)
-	steps = np.random.randint(500,700)
 	scriptNames = scriptNamer.SampleNames()
-	script = Script(inputData, teamSizes, seed=seed, steps=steps,  alpha=alpha, beta=beta, gamma=gamma, requiredRoles=requiredRoles, omittedRoles=omittedRoles)
+	poolKey = PoolKey(teamSizes, alpha, beta, gamma)
+	poolable = len(requiredRoles) == 0 and len(omittedRoles) == 0
+	pooled = scriptPool.get(poolKey, [])
+	while len(pooled) > 0 and pooled[0].data is not inputData:
+		pooled.pop(0) # sampled from data that has since been replaced
+	if poolable and len(pooled) > 0:
+		script = pooled.pop(0)
+		poolStats["hits"] += 1
+	else:
+		if poolable:
+			poolStats["misses"] += 1
+		script = await RunJob(message, lambda: NewScript(teamSizes, alpha, beta, gamma, requiredRoles, omittedRoles))
+		if poolable and poolKey not in scriptPool and len(scriptPool) < poolKeys:
+			scriptPool[poolKey] = [] # only once we know these sizes work
+	logging.info("Script pool hits %d, misses %d" % (poolStats["hits"], poolStats["misses"]))
+	if script.profile:
+		logging.info("Profile %s: %s" % (script.ID(), script.profile))
 	nameStr = "**Suggested names** (please choose one):"
 	for i in range(len(scriptNames)):
 		nameStr += "\n(%d) %s" % (i+1, scriptNames[i])
@@ -189,12 +308,17 @@ Stop after a few hundred iterations.
 		"name": scriptName,
 		"logo": "https://raw.githubusercontent.com/nicfreeman1209/pyscriptgen/main/logo.png"
 		})
-	pdfFile = io.BytesIO(scriptPdf.PdfAsBytes(toolScript, scriptName))
-	await message.channel.send(content=contentMsg, file=discord.File(fp=pdfFile, filename=scriptName+".pdf"))	
+	pdfProfile = Profile() if profiling else None
+	pdfFile = io.BytesIO(await RunJob(message, lambda: scriptPdf.PdfAsBytes(toolScript, scriptName, pdfProfile)))
+	with Timer(pdfProfile, "upload"):
+		await message.channel.send(content=contentMsg, file=discord.File(fp=pdfFile, filename=scriptName+".pdf"))	
+	if pdfProfile:
+		logging.info("Profile %s pdf: %s" % (script.ID(), pdfProfile))
 	jsonFile = io.StringIO(json.dumps(toolScript))
 	await message.channel.send(content="", file=discord.File(fp=jsonFile, filename=scriptName+".json"))
 	
 	logging.info("Created %s for %s in %s, %s" % (script.ID(), message.author.display_name, message.guild.name if message.guild else "DM", scriptName))
+	logging.info("Pdf cache %s" % ", ".join("%s %d" % kv for kv in scriptPdf.cacheStats.items()))
 
 @bot.event
 async def close():
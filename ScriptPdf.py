@@ -1,49 +1,60 @@
 import json
 import os
 import sys
+import glob
+import time
+import argparse
 import PIL
 import datetime
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import ImageOps
 from PIL import ImageChops
 from PIL import Image
 from fpdf import FPDF
-
-def SanitizeName(s):
-	# convert role["name"] into the roleId used by the script tool (which is not equal to role["id"] ffs)
-	s = s.lower()
-	s = s.replace(' ', '_')
-	s = s.replace("'","")
-	if s == "mephit":
-		s = "mezepheles"
-	s = s.strip()
-	return s
-
-def SanitizeText(s):
-	# remove non-pdf-able characters
-	s = s.replace("“", "'")
-	s = s.replace("”", "'")
-	s = s.replace("’","'")
-	s = s.replace("−","-")
-	s.strip()
-	return s
-	
+from fpdf.image_parsing import preload_image
+from fpdf.image_datastructures import ImageCache
+from ScriptProfile import Timer
+from ScriptCatalog import SanitizeName, GetCatalog
 
 class ScriptPdf:
-	def __init__(self, path):
+	# layout, in mm
+	pt = 0.36
+	fontSize = 10
+	fontName = 'Helvetica'
+	lMargin = 12
+	colWidth = 95
+	midMargin = 2
+	imSize = 12
+	
+	cacheVersion = 1 # bump whenever the rendered output changes, so old pdfs in cacheDir aren't served
+	
+	def __init__(self, path, cacheSize=32, cacheDir=None):
 		self.path = path
-		with open(os.path.join(self.path, "official", "roles.json"), "r") as j:
-			self.roles = json.load(j)
-		with open(os.path.join(self.path, "official", "hatred.json"), "r") as j:
-			self.hatred = json.load(j)
+		self.catalog = GetCatalog(path) # roles.json & hatred.json, shared with ScriptSampler
+		self.rolesDict = self.catalog.roleInfo
+		
+		# rendered pdfs, keyed by PdfKey: the most recent cacheSize in memory, and every one in cacheDir (if given)
+		self.cacheSize = cacheSize
+		self.cacheDir = cacheDir
+		self.pdfCache = OrderedDict() # key -> pdf bytes, least recently used first
+		self.cacheStats = {"hits": 0, "diskHits": 0, "misses": 0, "evictions": 0}
+		self.cacheLock = threading.Lock()
+		self.inputHash = self.catalog.inputHash
+		if self.cacheDir:
+			os.makedirs(self.cacheDir, exist_ok=True)
 		self.iconDir = os.path.join(self.path, "official", "icons")
 		
-		self.rolesDict = {}
-		for role in self.roles:
-			name = SanitizeName(role["name"])
-			self.rolesDict[name] = role
-			self.rolesDict[name]["ability"] = SanitizeText(role["ability"])
-			self.rolesDict[name]["firstNightReminder"] = SanitizeText(role["firstNightReminder"])
-			self.rolesDict[name]["otherNightReminder"] = SanitizeText(role["otherNightReminder"])
+		# every icon is read, decoded & compressed for embedding once, here
+		# each pdf then starts from a copy of this cache, and only embeds the icons it uses
+		self.iconCache = ImageCache()
+		for iconFile in sorted(os.listdir(self.iconDir)):
+			if iconFile.endswith(".png"):
+				preload_image(self.iconCache, os.path.join(self.iconDir, iconFile))
+		self.iconCache.reset_usages()
 		
 		self.teamColors = {
 			"townsfolk": (20,118,212),
@@ -69,7 +80,10 @@ class ScriptPdf:
 				if key != "id":
 					script.append(role)
 					continue
-			script.append(self.rolesDict[role["id"]])
+			roleId = SanitizeName(role["id"]) # scripts in the wild use old names, spaces etc
+			if roleId not in self.rolesDict:
+				continue # e.g. fabled, which have no entry in roles.json
+			script.append(self.rolesDict[roleId])
 		
 			
 		# record the night reminders, in order
@@ -84,198 +98,339 @@ class ScriptPdf:
 		otherNightOrder = sorted(otherNightOrder, key=lambda x: x[0])
 		
 		# record the jinxes
-		for _jinx in self.hatred:
-			role1 = _jinx["id"]
-			for jinx in _jinx["hatred"]:
-				role2 = jinx["id"]
-				if role1 in roleNames and role2 in roleNames:
-					jinxes.append((role1, role2, jinx["reason"]))
+		jinxes = self.catalog.JinxesAmong([SanitizeName(name) for name in roleNames])
 		
 		return script, firstNightOrder, otherNightOrder, jinxes
 		
-	def _Pdf(self, toolScript, scriptName, dummyRun=False, pageY=297):		  
-		script, firstNightOrder, otherNightOrder, jinxes = self.FullScript(toolScript)
+	def IconCache(self):
+		# copies of the info dicts, as fpdf counts usages in them, the image data itself is shared
+		return ImageCache(images={name : type(info)(info) for name,info in self.iconCache.images.items()},
+						  icc_profiles=dict(self.iconCache.icc_profiles),
+						  image_filter=self.iconCache.image_filter)
 		
-		pageX = 210
-		pageY = max(297, pageY) # pageY should be obtained from dummyRun=True
-		pdf = FPDF(format=(pageX, pageY), unit="mm", orientation="P") # 210 x 297
-		pdf.add_page()
-		pdf.set_margin(0)
+	def Layout(self, script, firstNightOrder, otherNightOrder, jinxes):
+		# where everything goes, without drawing anything: [(Draw method, args)] in drawing order, and the height the first page needs
+		# every block has a fixed height (text that overflows a block doesn't push the next one down), so nothing needs measuring
+		pt = self.pt
+		fontSize = self.fontSize
+		imSize = self.imSize
+		x1 = self.lMargin
+		x2 = self.lMargin + self.colWidth + self.midMargin
+		blockHeight = fontSize*pt*5.5 # one role or jinx
+		plan = []
+		pageY = None
+		
+		def PageBreak(y):
+			nonlocal pageY
+			if pageY is None:
+				pageY = y # the first page is stretched to fit everything before its break
+			plan.append((self.DrawPageBreak, ()))
+			return 15
 		
-		# title
-		pdf.set_xy(0,10)
-		pdf.set_font('Helvetica', 'B', 16)
-		pdf.cell(w=210, h=0, align='C', txt=scriptName, border=0)
-
-		pt = 0.36
-		fontSize = 10
-		fontName = 'Helvetica'
-		pdf.set_font(fontName, '', fontSize)
 		y = 20
-		lMargin = 12
-		colWidth = 95
-		midMargin = 2
-		imSize = 12
-		x1 = lMargin
-		x2 = lMargin + colWidth + midMargin
 		x = x2
-
-		teamColors = {
-			"townsfolk": (20,118,212),
-			"outsider": (20,118,212),
-			"minion": (149,18,36),
-			"demon": (149,18,36),
-			"traveler": (100,100,100),
-		}
-
-		def AddRole(x, y, role):
-			if role:
-				imageFile = os.path.join(self.path, "official", "icons", role["id"]+".png")
-				pdf.image(imageFile, x=x, y=y, w=imSize, h=imSize)
-				pdf.set_xy(x+imSize,y)
-				pdf.set_font(fontName, '', fontSize)
-				pdf.multi_cell(w=colWidth-imSize, h=3.5, align='L', txt="**" + role["name"] + ":** " + role["ability"], border=0, markdown=True)
-			y += fontSize*pt*5.5
-			return y
-
-		def AddTeamRect(y1,y2, teamName="TEAM"):
-			w = lMargin/3
-			h = y2-y1-fontSize*pt  
-			pdf.rect(x=lMargin/3, y=y1-fontSize*pt/2, w=w, h=h)
-			pdf.set_xy(lMargin/3, h+y1-fontSize*pt/2)
-			with FPDF.rotation(pdf, angle=90, x=pdf.get_x(), y=pdf.get_y()):
-				pdf.set_xy(pdf.get_x(),pdf.get_y()+lMargin/3/2+0.2)
-				color = teamColors[teamName]
-				pdf.set_text_color(*color)
-				pdf.set_font(fontName, '', fontSize-1)
-				pdf.cell(w=h,h=0,align="C",txt=teamName.upper())
-				pdf.set_text_color(0,0,0)
-				pdf.set_font(fontName, '', fontSize)
-
 		prevTeam = "townsfolk"
 		y += fontSize*pt*0.5
 		y1 = y
-		y2 = None
 
 		# roles & related margin 
 		for role in script:
 			if role["team"] != prevTeam:
 				if x == x1:
-					y = AddRole(x,y,None)
+					y += blockHeight
 				x = x2
 				y += fontSize*pt*0.75
-				AddTeamRect(y1,y, prevTeam)
+				plan.append((self.DrawTeamRect, (y1, y, prevTeam)))
 				prevTeam = role["team"]
 				if role["team"] == "traveler":
-					pdf.add_page()
-					if dummyRun:
-						return None, y
-					pdf.set_xy(0,10)
-					y = 15
+					y = PageBreak(y)
 				y1 = y
 			if x == x2:
 				x = x1
-				AddRole(x, y, role)
+				plan.append((self.DrawRole, (x, y, role)))
 			else:
 				x = x2
-				y = AddRole(x, y, role)
+				plan.append((self.DrawRole, (x, y, role)))
+				y += blockHeight
 
 		if x == x1:
-			y = AddRole(x,y,None)
+			y += blockHeight
 		if role["team"] == "traveler":
-			AddTeamRect(y1,y, "traveler")
+			plan.append((self.DrawTeamRect, (y1, y, "traveler")))
 			y += fontSize*pt*3
 		else:
 			y += fontSize*pt*0.75
-			AddTeamRect(y1,y, prevTeam)
-			pdf.add_page()
-			if dummyRun:
-				return None, y
-			pdf.set_xy(0,10)
-			y = 15
+			plan.append((self.DrawTeamRect, (y1, y, prevTeam)))
+			y = PageBreak(y)
 
 		x = x2
 		y += fontSize*pt*3
 		
 		# jinxes
 		if len(jinxes)>0:
-			pdf.set_xy(x1+imSize, y)
-			pdf.cell(w=colWidth, h=0, align='L', txt="JINXES", border=0, markdown=True)
+			plan.append((self.DrawText, (x1+imSize, y, "JINXES")))
 			y += fontSize*pt*2
 
-		def AddJinx(x,y, role1, role2, text):
-			if text:
-				pdf.set_xy(x+imSize,y)
-				text = "**"+role1+" & "+role2+":**\n"+text
-				pdf.multi_cell(w=colWidth-imSize, h=3.5, align='L', txt=text, border=0, markdown=True)		
-			y += fontSize*pt*5.5
-			return y
-
 		for role1,role2,text in jinxes:
 			if x == x2:
 				x = x1
-				AddJinx(x, y, role1, role2, text)
+				plan.append((self.DrawJinx, (x, y, role1, role2, text)))
 			else:
 				x = x2
-				y = AddJinx(x, y, role1, role2, text)
+				plan.append((self.DrawJinx, (x, y, role1, role2, text)))
+				y += blockHeight
 
 		if x==x1:
-			y = AddJinx(x,y, None,None,None)
+			y += blockHeight
 
 		y += fontSize*pt*3
 		x = x1
 		
 		# first night order
 		y_nightOrder = y
-		pdf.set_xy(x1+imSize, y)
-		pdf.cell(w=colWidth, h=0, align='L', txt="FIRST NIGHT", border=0, markdown=True)
+		plan.append((self.DrawText, (x1+imSize, y, "FIRST NIGHT")))
 		y += fontSize*pt
 
 		for _,name,reminder in firstNightOrder:
 			y += fontSize*pt
-			pdf.set_xy(x1+imSize,y)
-			pdf.cell(w=colWidth, h=0, align="L", txt=name, markdown=True)
+			plan.append((self.DrawText, (x1+imSize, y, name)))
 			
 		# other night order
 		y = y_nightOrder
-		pdf.set_xy(x2+imSize, y)
-		pdf.cell(w=colWidth, h=0, align='L', txt="OTHER NIGHT", border=0, markdown=True)
+		plan.append((self.DrawText, (x2+imSize, y, "OTHER NIGHT")))
 		y += fontSize*pt
 
 		for _,name,reminder in otherNightOrder:
 			y += fontSize*pt
-			pdf.set_xy(x2+imSize,y)
-			pdf.cell(w=colWidth, h=0, align="L", txt=name, markdown=True)
+			plan.append((self.DrawText, (x2+imSize, y, name)))
+		
+		return plan, pageY
+	
+	def DrawRole(self, pdf, x, y, role):
+		imageFile = os.path.join(self.iconDir, role["id"]+".png") # preloaded, unless the icon is missing from iconDir
+		pdf.image(imageFile, x=x, y=y, w=self.imSize, h=self.imSize)
+		pdf.set_xy(x+self.imSize,y)
+		pdf.set_font(self.fontName, '', self.fontSize)
+		pdf.multi_cell(w=self.colWidth-self.imSize, h=3.5, align='L', txt="**" + role["name"] + ":** " + role["ability"], border=0, markdown=True)
+	
+	def DrawTeamRect(self, pdf, y1, y2, teamName="TEAM"):
+		pt = self.pt
+		fontSize = self.fontSize
+		w = self.lMargin/3
+		h = y2-y1-fontSize*pt  
+		pdf.rect(x=self.lMargin/3, y=y1-fontSize*pt/2, w=w, h=h)
+		pdf.set_xy(self.lMargin/3, h+y1-fontSize*pt/2)
+		with FPDF.rotation(pdf, angle=90, x=pdf.get_x(), y=pdf.get_y()):
+			pdf.set_xy(pdf.get_x(),pdf.get_y()+self.lMargin/3/2+0.2)
+			color = self.teamColors[teamName]
+			pdf.set_text_color(*color)
+			pdf.set_font(self.fontName, '', fontSize-1)
+			pdf.cell(w=h,h=0,align="C",txt=teamName.upper())
+			pdf.set_text_color(0,0,0)
+			pdf.set_font(self.fontName, '', fontSize)
+	
+	def DrawJinx(self, pdf, x, y, role1, role2, text):
+		if text:
+			pdf.set_xy(x+self.imSize,y)
+			text = "**"+role1+" & "+role2+":**\n"+text
+			pdf.multi_cell(w=self.colWidth-self.imSize, h=3.5, align='L', txt=text, border=0, markdown=True)		
+	
+	def DrawText(self, pdf, x, y, text):
+		pdf.set_xy(x, y)
+		pdf.cell(w=self.colWidth, h=0, align='L', txt=text, border=0, markdown=True)
+	
+	def DrawPageBreak(self, pdf):
+		pdf.add_page()
+		pdf.set_xy(0,10)
+	
+	def _Pdf(self, plan, pageY, scriptName, today=None):
+		pageX = 210
+		pageY = max(297, pageY)
+		pdf = FPDF(format=(pageX, pageY), unit="mm", orientation="P") # 210 x 297
+		pdf.image_cache = self.IconCache()
+		pdf.add_page()
+		pdf.set_margin(0)
+		
+		# title
+		pdf.set_xy(0,10)
+		pdf.set_font('Helvetica', 'B', 16)
+		pdf.cell(w=210, h=0, align='C', txt=scriptName, border=0)
+		pdf.set_font(self.fontName, '', self.fontSize)
+		
+		for draw,args in plan:
+			draw(pdf, *args)
 		
 		# date at bottom
-		today = datetime.datetime.now().strftime("%Y-%m-%d")		
-		pdf.set_xy(x1+imSize, pageY-15)
+		today = today or datetime.datetime.now().strftime("%Y-%m-%d")		
+		pdf.set_xy(self.lMargin+self.imSize, pageY-15)
 		pdf.set_text_color(150,150,150)
-		pdf.cell(w=colWidth, h=0, align="L", txt=today)
+		pdf.cell(w=self.colWidth, h=0, align="L", txt=today)
 		
 		return pdf
 		
-	def Pdf(self, toolScript, scriptName):
-		# dummy run to calc page height, then write the pdf
-		_,pageY = self._Pdf(toolScript, scriptName, dummyRun=True)
-		return self._Pdf(toolScript, scriptName, pageY=pageY)
+	def Pdf(self, toolScript, scriptName, profile=None, today=None):
+		# lay everything out (which gives the page height), then draw it all in one pass
+		# profile (ScriptProfile.Profile) gets the time of each stage
+		with Timer(profile, "fullScript"):
+			script, firstNightOrder, otherNightOrder, jinxes = self.FullScript(toolScript)
+		with Timer(profile, "layout"):
+			plan, pageY = self.Layout(script, firstNightOrder, otherNightOrder, jinxes)
+		with Timer(profile, "render"):
+			return self._Pdf(plan, pageY, scriptName, today)
 		
-	def PdfAsBytes(self, toolScript, scriptName):
-		pdf = self.Pdf(toolScript, scriptName)
-		return pdf.output(dest='S')
+	def PdfKey(self, toolScript, scriptName, today):
+		# everything the rendered pdf depends on, the date included as it is printed on the pdf
+		h = hashlib.sha256()
+		h.update(json.dumps([self.cacheVersion, self.inputHash, toolScript, scriptName, today], sort_keys=True, separators=(",", ":")).encode())
+		return h.hexdigest()
+	
+	def CachedPdf(self, key):
+		# pdf bytes from the memory or disk cache, None if it isn't cached
+		with self.cacheLock:
+			if key in self.pdfCache:
+				self.pdfCache.move_to_end(key)
+				self.cacheStats["hits"] += 1
+				return self.pdfCache[key]
+		if self.cacheDir:
+			try:
+				with open(os.path.join(self.cacheDir, key+".pdf"), "rb") as f:
+					pdfBytes = f.read()
+				self.CachePdf(key, pdfBytes, toDisk=False)
+				with self.cacheLock:
+					self.cacheStats["diskHits"] += 1
+				return pdfBytes
+			except OSError:
+				pass
+		with self.cacheLock:
+			self.cacheStats["misses"] += 1
+		return None
+	
+	def CachePdf(self, key, pdfBytes, toDisk=True):
+		with self.cacheLock:
+			self.pdfCache[key] = pdfBytes
+			while len(self.pdfCache) > self.cacheSize:
+				self.pdfCache.popitem(last=False)
+				self.cacheStats["evictions"] += 1
+		if self.cacheDir and toDisk:
+			# a temp file of our own, so threads or processes sharing cacheDir never read each other's partial writes
+			try:
+				fd, tmpName = tempfile.mkstemp(dir=self.cacheDir, prefix=key, suffix=".tmp")
+			except OSError:
+				return # the memory cache still works
+			try:
+				with os.fdopen(fd, "wb") as f:
+					f.write(pdfBytes)
+				os.replace(tmpName, os.path.join(self.cacheDir, key+".pdf"))
+			except OSError:
+				try:
+					os.remove(tmpName)
+				except OSError:
+					pass
+	
+	def PdfAsBytes(self, toolScript, scriptName, profile=None):
+		today = datetime.datetime.now().strftime("%Y-%m-%d")
+		key = self.PdfKey(toolScript, scriptName, today)
+		pdfBytes = self.CachedPdf(key)
+		if pdfBytes is not None:
+			if profile:
+				profile.Count("cacheHits")
+			return pdfBytes
+		pdf = self.Pdf(toolScript, scriptName, profile, today)
+		with Timer(profile, "output"):
+			pdfBytes = bytes(pdf.output(dest='S'))
+		self.CachePdf(key, pdfBytes)
+		return pdfBytes
 		
-	def PdfToFile(self, toolScript, scriptName, scriptDir):
-		pdf = self.Pdf(toolScript, scriptName)
-		pdf.output(os.path.join(scriptDir, scriptName+".pdf"))
+	def PdfToFile(self, toolScript, scriptName, scriptDir, profile=None):
+		pdfBytes = self.PdfAsBytes(toolScript, scriptName, profile)
+		with open(os.path.join(scriptDir, scriptName+".pdf"), "wb") as f:
+			f.write(pdfBytes)
 		return
 			
+workerPdf = None # ScriptPdf, set once per RenderBatch worker process
+
+def InitWorker(path):
+	global workerPdf
+	workerPdf = ScriptPdf(path)
+
+def ScriptNameFromFile(fileName):
+	# e.g. scripts/Bad_Moon_Rising.json -> "Bad Moon Rising", scripts/Full_Moon_Rising_v1.3.json -> "Full Moon Rising v1.3"
+	scriptName = os.path.splitext(os.path.basename(fileName))[0]
+	return scriptName.replace("_"," ")
+
+def PdfFile(fileName, outDir=None):
+	# where the pdf for a tool script file goes, next to it unless outDir is given
+	return os.path.join(outDir or os.path.dirname(fileName), ScriptNameFromFile(fileName)+".pdf")
+
+def RenderInWorker(fileName, outDir):
+	# returns an error message, None on success
+	try:
+		with open(fileName, "r") as f:
+			toolScript = json.load(f)
+		workerPdf.PdfToFile(toolScript, ScriptNameFromFile(fileName), os.path.dirname(PdfFile(fileName, outDir)))
+	except Exception as e:
+		return "%s: %s" % (type(e).__name__, e)
+	return None
+
+def RenderBatch(fileNames, path="public", outDir=None, maxWorkers=None, force=False):
+	# render each tool script file to pdf over a process pool, skipping pdfs newer than their script unless force
+	# scripts whose pdfs would have the same file name (e.g. A_B.json & A B.json) aren't rendered, and count as failures
+	# returns the number of failures
+	pdfSources = {} # pdf file -> [script files]
+	for fileName in dict.fromkeys(os.path.normpath(fileName) for fileName in fileNames):
+		pdfSources.setdefault(PdfFile(fileName, outDir), []).append(fileName)
+	todo = []
+	clashes = []
+	for pdfFile,sources in pdfSources.items():
+		if len(sources) > 1:
+			clashes += sources
+			print("Not rendering %s, they would all be %s" % (", ".join(sources), pdfFile), flush=True)
+		elif force or not os.path.exists(pdfFile) or os.path.getmtime(pdfFile) < os.path.getmtime(sources[0]):
+			todo.append(sources[0])
+	nScripts = sum(len(sources) for sources in pdfSources.values())
+	print("%d scripts, %d up to date, %d clashing, %d to render" % (nScripts, nScripts-len(todo)-len(clashes), len(clashes), len(todo)), flush=True)
+	if outDir:
+		os.makedirs(outDir, exist_ok=True)
+	
+	start = time.perf_counter()
+	failures = len(clashes)
+	def Progress(i, fileName, error):
+		print("[%d/%d] %s%s" % (i+1, len(todo), fileName, " FAILED " + error if error else ""), flush=True)
+	if maxWorkers == 1 or len(todo) <= 1:
+		InitWorker(path)
+		for i,fileName in enumerate(todo):
+			error = RenderInWorker(fileName, outDir)
+			failures += error is not None
+			Progress(i, fileName, error)
+	else:
+		with ProcessPoolExecutor(max_workers=maxWorkers, initializer=InitWorker, initargs=(path,)) as executor:
+			futures = {executor.submit(RenderInWorker, fileName, outDir) : fileName for fileName in todo}
+			for i,future in enumerate(as_completed(futures)):
+				error = future.result()
+				failures += error is not None
+				Progress(i, futures[future], error)
+	
+	elapsed = time.perf_counter() - start
+	if len(todo) > 0:
+		rendered = len(todo) - (failures - len(clashes))
+		print("%d pdfs in %.1fs, %.1f pdfs/s, %d failed" % (rendered, elapsed, rendered/elapsed, failures))
+	return failures
+
 if __name__ == '__main__':
-	fileName = sys.argv[1] 
-	with open(fileName, "r") as f:
-		toolScript = json.load(f)
-		scriptDir, scriptName = os.path.split(fileName)
-		scriptName = scriptName.split(".")[0]
-		scriptName = scriptName.replace("_"," ")
-		scriptPdf = ScriptPdf("public")
-		scriptPdf.PdfToFile(toolScript, scriptName, scriptDir)
+	# python ScriptPdf.py my_script.json -> my_script.pdf next to it
+	# python ScriptPdf.py public/scripts --out pdfs --workers 4 -> every .json in a dir (or glob), in parallel
+	parser = argparse.ArgumentParser()
+	parser.add_argument("inputs", nargs="+", help="tool script .json files, dirs of them, or globs")
+	parser.add_argument("--out", default=None, help="dir for the pdfs, default next to each script")
+	parser.add_argument("--workers", type=int, default=None, help="worker processes, default one per cpu")
+	parser.add_argument("--data", default="public", help="data dir with official/")
+	parser.add_argument("--force", action="store_true", help="also render scripts whose pdf is newer")
+	args = parser.parse_args()
 	
+	fileNames = []
+	for arg in args.inputs:
+		if os.path.isdir(arg):
+			fileNames += sorted(glob.glob(os.path.join(arg, "*.json")))
+		else:
+			fileNames += sorted(glob.glob(arg))
+	sys.exit(1 if RenderBatch(fileNames, args.data, args.out, args.workers, args.force) > 0 else 0)
@@ -0,0 +1,67 @@
+# license: GPL v3
+import time
+from contextlib import nullcontext
+
+class Profile:
+	# wall clock time per phase & counts of things, for one script or pdf
+	# only created when profiling is asked for, code paths check for None (or are only instrumented when it exists)
+	def __init__(self):
+		self.times = {} # phase -> seconds, phases may be nested
+		self.counts = {} # name -> count
+		self.sizes = {} # name -> [number of samples, total, max]
+
+	def Add(self, phase, seconds):
+		self.times[phase] = self.times.get(phase, 0) + seconds
+
+	def Count(self, name, n=1):
+		self.counts[name] = self.counts.get(name, 0) + n
+
+	def Size(self, name, size):
+		if name not in self.sizes:
+			self.sizes[name] = [0, 0, 0]
+		s = self.sizes[name]
+		s[0] += 1
+		s[1] += size
+		s[2] = max(s[2], size)
+
+	def Timed(self, phase, f):
+		# f, with the time of each call added to phase
+		def TimedF(*args, **kwargs):
+			start = time.perf_counter()
+			try:
+				return f(*args, **kwargs)
+			finally:
+				self.Add(phase, time.perf_counter() - start)
+		return TimedF
+
+	def Summary(self):
+		# plain dict, e.g. for json logs
+		return {
+			"times" : dict(self.times),
+			"counts" : dict(self.counts),
+			"sizes" : {name : {"mean" : s[1]/s[0], "max" : s[2]} for name,s in self.sizes.items()},
+		}
+
+	def __repr__(self):
+		s = ["%s=%.1fms" % (phase, 1e3*t) for phase,t in self.times.items()]
+		s += ["%s=%d" % (name, n) for name,n in self.counts.items()]
+		s += ["%s=%.1f/%d" % (name, sz[1]/sz[0], sz[2]) for name,sz in self.sizes.items()]
+		return " ".join(s)
+
+class _Timer:
+	def __init__(self, profile, phase):
+		self.profile = profile
+		self.phase = phase
+
+	def __enter__(self):
+		self.start = time.perf_counter()
+
+	def __exit__(self, *exc):
+		self.profile.Add(self.phase, time.perf_counter() - self.start)
+		return False
+
+def Timer(profile, phase):
+	# with Timer(profile, "phase"): ..., a no-op if profile is None
+	if profile is None:
+		return nullcontext()
+	return _Timer(profile, phase)
@@ -2,54 +2,51 @@
 import json
 import glob
 import os
-import matplotlib.pyplot as plt
+import sys
+import copy
+import hashlib
+import threading
+import time
+import logging
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
 import numpy as np
-import openpyxl
-from fuzzywuzzy import process
+from ScriptProfile import Profile, Timer
+from ScriptCatalog import SanitizeName, SAO, standardAmyOrder, GetCatalog
+try:
+	# much faster, same scorer as fuzzywuzzy when given its preprocessing
+	from rapidfuzz import process, utils
+	fuzzyKwargs = {"processor": utils.default_process}
+except ImportError:
+	from fuzzywuzzy import process
+	fuzzyKwargs = {}
 
-
-def SanitizeName(s):
-	s = s.lower()
-	s = s.replace(' ', '_')
-	s = s.replace("'","")
-	if s == "mephit":
-		s = "mezepheles"
-	s = s.strip()
-	return s
-	
-def WeightedSampleFromDict(d):
+def CompactName(s):
+	# "Fortune Teller", "fortune_teller", "fortuneteller" & "fortune-teller" all -> "fortuneteller"
+	return ''.join(c for c in SanitizeName(s) if c.isalnum())
+	
+def WeightedSampleFromDict(d, rng=np.random):
 	k = np.array(list(d.keys()))
 	p = np.array(list(d.values())) / np.sum(list(d.values()))
-	return np.random.choice(k, p=p)
-	
-
-# a version of Standard "Amy" Order
-standardAmyOrder = [
-	"you start",
-	"each night,",
-	"each night*",
-	"each day",
-	"once per game, at night,",
-	"once per game, at night*",
-	"once per game, during the day",
-	"once per game",
-	"on your 1st night",
-	"on your 1st day",
-	"when",
-	"if you",
-	"if",
-	"you",
-]
+	return rng.choice(k, p=p)
 
-def SAO(_s):
-	s = _s.lower()
-	for i,prefix in enumerate(standardAmyOrder):
-		if s.startswith(prefix):
-			return i
-	return len(standardAmyOrder)	
+class WeightedSampler:
+	# inverse-CDF sampler, build once for a fixed distribution and draw from it many times
+	def __init__(self, values, weights):
+		self.values = np.asarray(values)
+		self.cdf = np.cumsum(weights, dtype=float)
+		
+	def Sample(self, rng):
+		i = np.searchsorted(self.cdf, rng.random() * self.cdf[-1], side="right")
+		return self.values[min(i, len(self.values)-1)]
+	
 
 class Data:
-	def __init__(self, path):
+	teamNames = ["townsfolk", "outsider", "minion", "demon"]
+	cacheVersion = 2 # bump whenever the cached structures change
+	fuzzyCacheSize = 256 # role name lookups remembered by ResolveRole
+	
+	def __init__(self, path, useCache=True):
 		self.path = path
 		
 		self.teams = {} # teamName -> teamList
@@ -57,82 +54,270 @@ class Data:
 		self.rolesInv = {} # role -> idx
 		self.roleSAOs = {} # role -> saoClass
 		self.roleTeams = {} # role -> team
-		self.LoadRoles()
-		
+		self.teamMasks = {} # teamName -> bool array over role idx
+		self.saoMasks = {} # saoClass -> bool array over role idx
+		self.roleAliases = {} # CompactName of role (id, name, ...) -> role
+		self.fuzzyCache = OrderedDict() # role name arg -> role, least recently used first
 		self.jinxes = [] # idx -> (role1, role2)
-		self.LoadJinxes()
-		
+		self.scriptFiles = [] # scriptIdx -> file name in scripts/
+		self.incidence = None # [scriptIdx][roleIdx] -> count
 		self.roleAdjacency = None # [roleIdx1][roleIdx2] -> weight
 		self.saoDist = {} # saoClass -> weight	 
-		self.LoadScripts()
+		self.roleSAOIdx = None # roleIdx -> saoClass
+		
+		# summaries of roleAdjacency & saoDist used to score scripts, refreshed whenever the corpus changes
+		self.version = 0 # bumped on every refresh, so scripts know when their memoized scores are stale
+		self.adjacencyMedian = None
+		self.adjacencyRowSums = None # roleIdx -> total weight to all roles
+		self.saoFractions = None # saoClass -> fraction of townsfolk in the corpus
+
+		# the parsed corpus is cached on disk, and only rebuilt when the input files change
+		cacheFile = os.path.join(self.path, "data.npz")
+		inputHash = self.InputHash()
+		if not (useCache and self.LoadCache(cacheFile, inputHash)):
+			self.LoadRoles()
+			self.LoadJinxes()
+			self.LoadScripts()
+			if useCache:
+				self.SaveCache(cacheFile, inputHash)
 		
 		self.hardRestrictions = {} # role1 -> requires role2
 		self.LoadHardRestrictions()
-
-		self.WriteStats()
+		
+		self.jinxMatrix = None # [roleIdx1][roleIdx2] -> jinxed, symmetric
+		self.requires = {} # roleIdx -> [roleIdx it requires]
+		self.requiredBy = {} # roleIdx -> [roleIdx that require it]
+		self.IndexConstraints()
+		self.IndexAdjacency()
+		
+		self.statsLock = threading.Lock()
+		self.fuzzyLock = threading.Lock()
 		
 	def LoadRoles(self):
-		teamNames = ["townsfolk", "outsider", "minion", "demon"]
-		for team in teamNames:
-			self.teams[team] = []
-
-		with open(os.path.join(self.path, "official", "roles.json")) as j:
-			jsonRoles = json.load(j)
-			jsonRoles = sorted(jsonRoles, key=lambda x: SAO(x["ability"]))
-			jsonRoles = sorted(jsonRoles, key=lambda x: x["team"], reverse=True)
-			for role in jsonRoles:
-				if role["team"] not in self.teams:
-					continue
-				if role["id"] == "mephit":
-					continue # included with both names in roles.json
-				roleId = SanitizeName(role["name"])
-				self.teams[role["team"]].append(roleId)
-				self.roles.append(roleId)
-				self.rolesInv[roleId] = len(self.roles)-1
-				self.roleSAOs[roleId] = SAO(role["ability"])
-				self.roleTeams[roleId] = role["team"]				
+		catalog = GetCatalog(self.path)
+		self.roles = list(catalog.sampledRoles)
+		self.roleSAOs = dict(catalog.roleSAOs)
+		self.roleTeams = dict(catalog.roleTeams)
+		self.IndexRoles()
+	
+	def IndexRoles(self):
+		# lookups derived from roles & roleTeams
+		for team in self.teamNames:
+			self.teams[team] = [role for role in self.roles if self.roleTeams[role] == team]
+			self.teamMasks[team] = np.array([self.roleTeams[role] == team for role in self.roles])
+		self.rolesInv = {role : i for i,role in enumerate(self.roles)}
+		for saoClass in set(self.roleSAOs.values()):
+			self.saoMasks[saoClass] = np.array([self.roleSAOs[role] == saoClass for role in self.roles])
+		self.roleSAOIdx = np.array([self.roleSAOs[role] for role in self.roles])
+		self.roleAliases = {CompactName(role) : role for role in self.roles}
+		self.fuzzyCache = OrderedDict()
 	
 	def LoadJinxes(self):
-		with open(os.path.join(self.path, "official", "hatred.json")) as j:
-			jsonHatred = json.load(j)
-			for jinx in jsonHatred:
-				char1 = SanitizeName(jinx["id"])
-				for hatred in jinx["hatred"]:
-					char2 = SanitizeName(hatred["id"])
-					self.jinxes.append((char1, char2))	
+		self.jinxes = list(GetCatalog(self.path).jinxes)
 	
 	def LoadScripts(self):
+		# incidence matrix [scriptIdx][roleIdx] -> number of times the role is listed (in practice 0/1)
+		# co-occurrence counts are then X^T X, without the diagonal
+		self.scriptFiles = []
+		rows = []
+		for script in sorted(glob.glob(os.path.join(self.path,"scripts/") + "*.json")):
+			row = self.ParseScript(script)
+			if row is None:
+				continue
+			self.scriptFiles.append(os.path.basename(script))
+			rows.append(row)
+		self.incidence = np.array(rows).reshape(-1, len(self.roles))
+		
+		X = self.incidence.astype(float)
+		self.roleAdjacency = X.T @ X
+		np.fill_diagonal(self.roleAdjacency, 0)
+		
+		townsfolkCounts = X.sum(axis=0) * self.teamMasks["townsfolk"]
+		saos = np.array([self.roleSAOs[role] for role in self.roles])
 		for i in sorted(self.roleSAOs.values()):
-			self.saoDist[i] = 0
-
-		self.roleAdjacency = np.zeros((len(self.roles), len(self.roles)))
-		scripts = glob.glob(os.path.join(self.path,"scripts/") + "*.json")
-		for script in scripts:
-			with open(script) as j:
-				try:
-					jsonScript = json.load(j)
-				except:
-					continue
-				scriptRoles = []
-				for role in jsonScript:
-					roleId = SanitizeName(role["id"])
-					if roleId not in self.roles:
-						continue
-					scriptRoles.append(roleId)
-					assert(roleId in self.roles)
-					if roleId in self.teams["townsfolk"]:
-						self.saoDist[self.roleSAOs[roleId]] += 1
-				for role1 in scriptRoles:
-					for role2 in scriptRoles:
-						if role1 == role2:
-							continue
-						self.roleAdjacency[self.rolesInv[role1],self.rolesInv[role2]] += 1
+			self.saoDist[i] = int(np.sum(townsfolkCounts[saos == i]))
+	
+	def ParseScript(self, fileName):
+		# row of the incidence matrix for one script file, None if it can't be read
+		# anything other than a list of {"id" : role} (or a deleted file) is skipped, so a bad upload can't stop a reload
+		row = np.zeros(len(self.roles), dtype=np.uint8)
+		try:
+			with open(fileName) as j:
+				jsonScript = json.load(j)
+			for role in jsonScript:
+				roleIdx = self.rolesInv.get(SanitizeName(role["id"]))
+				if roleIdx is not None:
+					row[roleIdx] += 1
+		except (OSError, ValueError, TypeError, KeyError, AttributeError) as e:
+			logging.warning("Skipped script %s: %r" % (fileName, e))
+			return None
+		return row
+	
+	def AddScripts(self, paths):
+		# rank-1 update per script, a script already loaded from the same file name is replaced
+		self.RemoveScripts([path for path in paths if os.path.basename(path) in self.scriptFiles])
+		rows = []
+		for path in paths:
+			row = self.ParseScript(path)
+			if row is None:
+				continue
+			self.UpdateScriptCounts(row, 1)
+			self.scriptFiles.append(os.path.basename(path))
+			rows.append(row)
+		self.incidence = np.vstack([self.incidence] + rows)
+		self.IndexAdjacency()
+	
+	def RemoveScripts(self, paths):
+		names = set(os.path.basename(path) for path in paths)
+		keep = []
+		for i,name in enumerate(self.scriptFiles):
+			if name in names:
+				self.UpdateScriptCounts(self.incidence[i], -1)
+			else:
+				keep.append(i)
+		self.scriptFiles = [self.scriptFiles[i] for i in keep]
+		self.incidence = self.incidence[keep]
+		self.IndexAdjacency()
+	
+	def UpdateScriptCounts(self, row, sign):
+		x = row.astype(float)
+		self.roleAdjacency += sign * (np.outer(x, x) - np.diag(x*x))
+		for roleIdx in np.flatnonzero(row * self.teamMasks["townsfolk"]):
+			self.saoDist[self.roleSAOs[self.roles[roleIdx]]] += sign * int(row[roleIdx])
+	
+	def Copy(self):
+		# a copy that can be updated (AddScripts etc) without affecting scripts that are using this one
+		data = copy.copy(self)
+		data.scriptFiles = list(self.scriptFiles)
+		data.incidence = self.incidence.copy()
+		data.roleAdjacency = self.roleAdjacency.copy()
+		data.saoDist = dict(self.saoDist)
+		data.statsLock = threading.Lock()
+		data.fuzzyLock = threading.Lock()
+		data.fuzzyCache = OrderedDict(self.fuzzyCache)
+		return data
+	
+	def ResolveRole(self, roleArg):
+		# role for a user supplied name: exact (up to case, spaces, punctuation) if possible, else the closest match
+		role = self.roleAliases.get(CompactName(roleArg))
+		if role is not None:
+			return role
+		with self.fuzzyLock:
+			if roleArg in self.fuzzyCache:
+				self.fuzzyCache.move_to_end(roleArg)
+				return self.fuzzyCache[roleArg]
+		role = process.extractOne(roleArg, self.roles, **fuzzyKwargs)[0]
+		with self.fuzzyLock:
+			self.fuzzyCache[roleArg] = role
+			if len(self.fuzzyCache) > self.fuzzyCacheSize:
+				self.fuzzyCache.popitem(last=False)
+		return role
+	
+	def IndexAdjacency(self):
+		# new arrays rather than in place updates, so a Copy never changes the summaries of the original
+		self.adjacencyMedian = np.median(self.roleAdjacency)
+		self.adjacencyRowSums = self.roleAdjacency.sum(axis=1)
+		saoWeights = np.zeros(max(self.roleSAOs.values())+1)
+		for saoClass,weight in self.saoDist.items():
+			saoWeights[saoClass] = weight
+		self.saoFractions = saoWeights / np.sum(saoWeights)
+		self.version += 1
+	
+	def RolePopularity(self):
+		# number of scripts each role is on
+		return np.count_nonzero(self.incidence, axis=0)
+		
+	def SaveCache(self, cacheFile, inputHash):
+		try:
+			with open(cacheFile + ".tmp", "wb") as f:
+				np.savez(f,
+					version=self.cacheVersion,
+					inputHash=inputHash,
+					roles=np.array(self.roles),
+					roleTeams=np.array([self.roleTeams[role] for role in self.roles]),
+					roleSAOs=np.array([self.roleSAOs[role] for role in self.roles]),
+					jinxes=np.array(self.jinxes).reshape(-1,2),
+					scriptFiles=np.array(self.scriptFiles),
+					incidence=self.incidence,
+					roleAdjacency=self.roleAdjacency,
+					saoClasses=np.array(list(self.saoDist.keys())),
+					saoWeights=np.array(list(self.saoDist.values())),
+				)
+			os.replace(cacheFile + ".tmp", cacheFile)
+		except OSError:
+			pass # read-only data dir, we just won't have a cache
+	
+	def LoadCache(self, cacheFile, inputHash):
+		# returns False if there is no usable cache, in which case nothing has been loaded
+		if not os.path.exists(cacheFile):
+			return False
+		try:
+			with np.load(cacheFile) as cache:
+				if int(cache["version"]) != self.cacheVersion or str(cache["inputHash"]) != inputHash:
+					return False
+				self.roles = [str(role) for role in cache["roles"]]
+				self.roleTeams = {role : str(team) for role,team in zip(self.roles, cache["roleTeams"])}
+				self.roleSAOs = {role : int(sao) for role,sao in zip(self.roles, cache["roleSAOs"])}
+				self.jinxes = [(str(role1), str(role2)) for role1,role2 in cache["jinxes"]]
+				self.scriptFiles = [str(f) for f in cache["scriptFiles"]]
+				self.incidence = cache["incidence"]
+				self.roleAdjacency = cache["roleAdjacency"]
+				self.saoDist = {int(k) : int(v) for k,v in zip(cache["saoClasses"], cache["saoWeights"])}
+		except (OSError, KeyError, ValueError):
+			return False
+		self.IndexRoles()
+		return True
 		
 	def LoadHardRestrictions(self):
 		with open(os.path.join(self.path,"hardRestrictions.json")) as f:
 			self.hardRestrictions = json.load(f)
 	
+	def IndexConstraints(self):
+		# index based versions of jinxes & hardRestrictions, for the running counts kept by Script
+		self.jinxMatrix = np.zeros((len(self.roles), len(self.roles)), dtype=bool)
+		for role1,role2 in self.jinxes:
+			if role1 in self.rolesInv and role2 in self.rolesInv:
+				self.jinxMatrix[self.rolesInv[role1], self.rolesInv[role2]] = True
+				self.jinxMatrix[self.rolesInv[role2], self.rolesInv[role1]] = True
+		for role1,role2 in self.hardRestrictions.items():
+			if role1 in self.rolesInv and role2 in self.rolesInv:
+				self.requires.setdefault(self.rolesInv[role1], []).append(self.rolesInv[role2])
+				self.requiredBy.setdefault(self.rolesInv[role2], []).append(self.rolesInv[role1])
+	
+	def InputHash(self):
+		# content hash of everything the model is built from
+		h = hashlib.sha256()
+		files = [os.path.join(self.path, "official", "roles.json"), os.path.join(self.path, "official", "hatred.json")]
+		files += sorted(glob.glob(os.path.join(self.path,"scripts/") + "*.json"))
+		for fileName in files:
+			h.update(os.path.basename(fileName).encode())
+			with open(fileName, "rb") as f:
+				h.update(f.read())
+		return h.hexdigest()
+	
+	def UpdateStats(self):
+		# (re)write the stats files, unless those on disk were made from the same inputs
+		statsDir = os.path.join(self.path, "stats")
+		hashFile = os.path.join(statsDir, "inputs.sha256")
+		statsFiles = [os.path.join(statsDir, f) for f in ["heatmap.png", "heatmap.xlsx", "sao.png"]]
+		with self.statsLock:
+			inputHash = self.InputHash()
+			if os.path.exists(hashFile) and all(os.path.exists(f) for f in statsFiles):
+				with open(hashFile) as f:
+					if f.read().strip() == inputHash:
+						return
+			os.makedirs(statsDir, exist_ok=True)
+			self.WriteStats()
+			with open(hashFile, "w") as f:
+				f.write(inputHash)
+	
 	def WriteStats(self):
+		# imported here, as only the stats need them; the figures are only ever saved to file
+		import matplotlib
+		matplotlib.use("Agg")
+		import matplotlib.pyplot as plt
+		import openpyxl
+		
 		# heatmap of adjacency matrix
 		plt.clf()
 		plt.figure(figsize = (10,10))
@@ -178,67 +363,403 @@ class Data:
 		plt.clf()
 		
 
-class Script:
-	def __init__(self, inputData, teamSizes, seed=0, steps=1000, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[]):
+class Sampler:
+	# everything about a generation request that doesn't depend on the seed, shared by all chains that use it
+	def __init__(self, inputData, teamSizes, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[], saoFilter=False):
 		self.data = inputData
 		self.teamSizes = teamSizes
-		self.seed = seed
-		self.nSteps = steps
 		self.alpha = alpha # pref attach init weight
 		self.beta = beta # pref attach power
 		self.gamma = gamma # distance along role weights vector to use in sampling (e.g. 0.5=median)
-		np.random.seed(seed)
+		self.saoFilter = saoFilter # only sample townsfolk from an SAO class drawn from the data, off by default as it raises the SAO variation
+		self.saoSampler = WeightedSampler(list(self.data.saoDist.keys()), list(self.data.saoDist.values()))
 		
 		self.requiredRoles = set()
 		self.omittedRoles = set()
 		for roleArg in requiredRoles:
-			self.requiredRoles.add(process.extractOne(roleArg, self.data.roles)[0])
+			self.requiredRoles.add(self.data.ResolveRole(roleArg))
 		for roleArg in omittedRoles:
-			self.omittedRoles.add(process.extractOne(roleArg, self.data.roles)[0])
+			self.omittedRoles.add(self.data.ResolveRole(roleArg))
 		self.omittedRoles = self.omittedRoles - self.requiredRoles
+		self.requiredMask = np.zeros(len(self.data.roles), dtype=bool) # roleIdx -> required
+		self.omittedMask = np.zeros(len(self.data.roles), dtype=bool) # roleIdx -> omitted
+		for role in self.requiredRoles:
+			self.requiredMask[self.data.rolesInv[role]] = True
+		for role in self.omittedRoles:
+			self.omittedMask[self.data.rolesInv[role]] = True
 		
-		self.script = {} # team -> [roles]
+		# scripts are vectors of role idxs, one per slot, with the slots of each team contiguous
+		self.teamSlots = {} # team -> [slot]
+		self.slotTeams = [] # slot -> team
+		self.candidateMasks = {} # team -> bool array of roles that may fill a slot of that team
+		self.nSlots = 0
 		for team,n in self.teamSizes.items():
-			rolesInit = list(set(self.data.teams[team]) - self.omittedRoles)
-			self.script[team] = np.random.choice(rolesInit, n, replace=False)
+			self.teamSlots[team] = np.arange(self.nSlots, self.nSlots+n)
+			self.slotTeams += [team] * n
+			self.candidateMasks[team] = self.data.teamMasks[team] & ~self.omittedMask
+			self.nSlots += n
+			
+	def BuildScripts(self, scripts):
+		# Script.BuildScript for many chains in lockstep, with one np.percentile call per step for the whole batch
+		# each chain draws from its own rng in the same order as Script.Step, so results match single chain runs
+		batchIdx = np.array([script.scriptIdx for script in scripts])
+		for i,script in enumerate(scripts):
+			script.scriptIdx = batchIdx[i] # a view, so Script methods see (and change) the batch state
+		
+		n = 0
+		while True:
+			active = False
+			stepping = [] # (chain, team, slot, sao)
+			for i,script in enumerate(scripts):
+				if script.stepsUsed is not None:
+					continue
+				if not script.KeepStepping(n):
+					script.FinishBuild(n)
+					continue
+				active = True
+				chosen = script.ChooseSlot()
+				if chosen is None:
+					continue
+				team, slot = chosen
+				script.SetSlot(slot, -1)
+				stepping.append((i, team, slot, script.SampleSAO(team)))
+			if not active:
+				break
+			n += 1
+			if len(stepping) == 0:
+				continue
+				
+			# every stepping chain has exactly one empty slot
+			filled = batchIdx[[i for i,_,_,_ in stepping]]
+			filled = filled[filled >= 0].reshape(len(stepping), -1)
+			if filled.shape[1] > 0:
+				w = self.alpha + np.percentile(self.data.roleAdjacency[filled], self.gamma*100, axis=1) ** self.beta
+			else:
+				w = np.zeros((len(stepping), len(self.data.roles)))
+			for (i,team,slot,sao),scriptIdx,roleWeights in zip(stepping, filled, w):
+				candidateMask = self.candidateMasks[team].copy()
+				candidateMask[scriptIdx] = False
+				candidates = np.flatnonzero(candidateMask)
+				scripts[i].FillSlot(team, slot, candidates, roleWeights[candidates], sao)
+		
+
+class Script:
+	def __init__(self, inputData, teamSizes, seed=0, steps=1000, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[], saoFilter=False, stop="fixed", tolerance=0.1, engine="vectorized", sampler=None, build=True, profile=False):
+		self.profile = Profile() if profile else None # per phase timings & counts, see ScriptProfile
+		if sampler is None:
+			with Timer(self.profile, "sampler"):
+				sampler = Sampler(inputData, teamSizes, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter)
+		self.sampler = sampler
+		self.data = sampler.data
+		self.teamSizes = sampler.teamSizes
+		self.seed = seed
+		self.nSteps = steps
+		self.stepsUsed = None # set once the script is built
+		self.alpha = sampler.alpha
+		self.beta = sampler.beta
+		self.gamma = sampler.gamma
+		self.requiredRoles = sampler.requiredRoles
+		self.omittedRoles = sampler.omittedRoles
+		self.requiredMask = sampler.requiredMask
+		self.omittedMask = sampler.omittedMask
+		self.teamSlots = sampler.teamSlots
+		self.rng = np.random.default_rng(seed) # private stream, so chains can run side by side
+		
+		# when to stop stepping: "fixed" runs nSteps (more if the script is still invalid)
+		# "converged" stops early, once the statistics recorded every window steps have settled, with nSteps as a cap
+		assert(stop in ["fixed", "converged"])
+		self.stop = stop
+		self.tolerance = tolerance # allowed spread of the recent statistics, relative to max(mean,1)
+		self.window = 2 * sampler.nSlots # steps between statistics snapshots
+		self.patience = 3 # number of snapshots averaged on each side of the comparison
+		self.history = [] # [(ScriptRoleAffinity, ScriptSAOVariation, fraction of steps that changed the role)]
+		self.nChanges = 0
+		self.emptiedRoleIdx = -1
+		self.scoreKey = None # (data.version, scriptIdx) that scores was computed for
+		self.scores = None # (ScriptRoleAffinity, ScriptSAOVariation)
+		
+		# how to compute candidate role weights in Step
+		engines = {
+			"reference" : self.RoleWeightsReference, # original dict-of-lists version, kept for testing
+			"vectorized" : self.RoleWeightsVectorized,
+		}
+		assert(engine in engines)
+		self.engine = engine
+		self.RoleWeights = engines[engine]
+		if self.profile:
+			self.Instrument()
+		
+		# empty slots hold -1
+		self.scriptIdx = np.zeros(sampler.nSlots, dtype=int) # slot -> roleIdx
+		for team,slots in self.teamSlots.items():
+			rolesInit = np.flatnonzero(sampler.candidateMasks[team])
+			self.scriptIdx[slots] = self.rng.choice(rolesInit, len(slots), replace=False)
 
 		# insert required roles
-		for role in self.requiredRoles:
-			team = self.data.roleTeams[role]
-			if role in self.script[team]:
+		for role in sorted(self.requiredRoles):
+			roleIdx = self.data.rolesInv[role]
+			slots = self.teamSlots[self.data.roleTeams[role]]
+			if roleIdx in self.scriptIdx[slots]:
 				continue
-			for i in range(len(self.script[team])):
-				if self.script[team][i] in self.requiredRoles:
+			for slot in slots:
+				if self.requiredMask[self.scriptIdx[slot]]:
 					continue
-				self.script[team][i] = role
+				self.scriptIdx[slot] = roleIdx
 				break
 		
-		self.BuildScript()
+		self.CountConstraints()
+		
+		# bring in the partners of roles with hard restrictions, e.g. the damsel for a huntsman
+		for slot in range(len(self.scriptIdx)):
+			self.PlacePartners(self.scriptIdx[slot], slot)
+		
+		if build:
+			self.BuildScript()
+	
+	@staticmethod
+	def GenerateBatch(inputData, teamSizes, seeds, steps=1000, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[], saoFilter=False, stop="fixed", tolerance=0.1, profile=False):
+		# one script per seed, sharing a single Sampler and run in lockstep
+		start = time.perf_counter()
+		sampler = Sampler(inputData, teamSizes, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter)
+		samplerTime = time.perf_counter() - start
+		scripts = [Script(inputData, teamSizes, seed=seed, steps=steps, stop=stop, tolerance=tolerance, sampler=sampler, build=False, profile=profile) for seed in seeds]
+		for script in scripts:
+			if script.profile:
+				script.profile.Add("sampler", samplerTime)
+		sampler.BuildScripts(scripts)
+		return scripts
+	
+	@staticmethod
+	def ParallelGenerate(inputData, teamSizes, seeds, steps=1000, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[], saoFilter=False, stop="fixed", tolerance=0.1, maxWorkers=None, batchSize=8):
+		# GenerateBatch over a process pool, each worker gets inputData once
+		# every chain depends only on its own seed, so the result doesn't depend on the number of workers
+		sampler = Sampler(inputData, teamSizes, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter)
+		args = (teamSizes, steps, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter, stop, tolerance)
+		batches = [seeds[i:i+batchSize] for i in range(0, len(seeds), batchSize)]
+		with ProcessPoolExecutor(max_workers=maxWorkers, initializer=InitWorker, initargs=(inputData,)) as executor:
+			results = list(executor.map(GenerateInWorker, batches, [args]*len(batches)))
+		return Script.FromWorkerResults(inputData, teamSizes, seeds, steps, stop, tolerance, sampler, [r for batch in results for r in batch])
+	
+	@staticmethod
+	def FromWorkerResults(inputData, teamSizes, seeds, steps, stop, tolerance, sampler, results, profile=False):
+		# rebuild the scripts here, rather than sending a copy of inputData back with each of them
+		scripts = []
+		for seed,(scriptIdx,stepsUsed) in zip(seeds, results):
+			script = Script(inputData, teamSizes, seed=seed, steps=steps, stop=stop, tolerance=tolerance, sampler=sampler, build=False, profile=profile)
+			script.scriptIdx = scriptIdx
+			script.FinishBuild(stepsUsed)
+			script.CountConstraints()
+			scripts.append(script)
+		return scripts
+	
+	@staticmethod
+	def GenerateBest(inputData, teamSizes, nChains, seed=0, steps=1000, alpha=0, beta=1, gamma=0.1, requiredRoles=[], omittedRoles=[], saoFilter=False, stop="fixed", tolerance=0.1, scorer=None, budget=None, maxWorkers=1, batchSize=8, profile=False):
+		# run chains with seeds seed, seed+1, ... and return the highest scoring script
+		# with a budget (seconds), only the batches of chains finished by then are used, but always at least one
+		# the budget is a soft limit: it is checked between batches (here) or when waiting on the pool, so a batch is never cut short
+		# and with a single batch it can't take effect, use a batchSize below nChains for it to
+		# maxWorkers=1 runs the batches here in lockstep, otherwise they go to a process pool
+		# with profile, the chosen script's profile also gets the total time & number of chains (worker step timings are not kept)
+		scorer = scorer or ScriptScore
+		start = time.perf_counter()
+		deadline = None if budget is None else time.monotonic() + budget
+		seeds = list(range(seed, seed+nChains))
+		batches = [seeds[i:i+batchSize] for i in range(0, len(seeds), batchSize)]
+		scripts = []
+		if maxWorkers == 1:
+			for batch in batches:
+				scripts += Script.GenerateBatch(inputData, teamSizes, batch, steps, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter, stop, tolerance, profile)
+				if deadline is not None and time.monotonic() > deadline:
+					break
+		else:
+			sampler = Sampler(inputData, teamSizes, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter)
+			args = (teamSizes, steps, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter, stop, tolerance)
+			executor = ProcessPoolExecutor(max_workers=maxWorkers, initializer=InitWorker, initargs=(inputData,))
+			futures = {executor.submit(GenerateInWorker, batch, args) : batch for batch in batches}
+			done, _ = wait(futures, timeout=None if deadline is None else max(deadline - time.monotonic(), 0))
+			if len(done) == 0:
+				done, _ = wait(futures, return_when=FIRST_COMPLETED)
+			executor.shutdown(wait=False, cancel_futures=True) # chains already running are left to finish, unused
+			for future in sorted(done, key=lambda future: futures[future][0]):
+				scripts += Script.FromWorkerResults(inputData, teamSizes, futures[future], steps, stop, tolerance, sampler, future.result(), profile)
+		best = max(scripts, key=scorer) # ties go to the lowest seed
+		if best.profile:
+			best.profile.Add("generateBest", time.perf_counter() - start)
+			best.profile.Count("chains", len(scripts))
+		return best
+	
+	@property
+	def script(self):
+		# team -> [roles]
+		return {team : [self.data.roles[i] if i >= 0 else "" for i in self.scriptIdx[slots]] for team,slots in self.teamSlots.items()}
 			
 	def ListRoles(self):
-		return [role for team in self.script for role in self.script[team]]
+		return [self.data.roles[i] for i in self.scriptIdx if i >= 0]
+	
+	def SetSlot(self, slot, roleIdx):
+		# all changes to the script after initialization go through here, -1 empties the slot
+		oldRoleIdx = self.scriptIdx[slot]
+		if roleIdx < 0:
+			self.emptiedRoleIdx = oldRoleIdx
+		elif oldRoleIdx < 0 and roleIdx != self.emptiedRoleIdx:
+			self.nChanges += 1
+		self.scriptIdx[slot] = -1
+		if oldRoleIdx >= 0:
+			self.UpdateConstraints(oldRoleIdx, -1)
+		if roleIdx >= 0:
+			self.UpdateConstraints(roleIdx, 1)
+		self.scriptIdx[slot] = roleIdx
 	
 	def BuildScript(self):
 		n = 0
-		while ((self.IsTheScriptActuallyBroken() or n < self.nSteps) and n < self.nSteps*2):
-			self.Step()
-			n += 1
+		with Timer(self.profile, "build"):
+			while self.KeepStepping(n):
+				self.Step()
+				n += 1
+		self.FinishBuild(n)
+	
+	def FinishBuild(self, n):
+		self.stepsUsed = n
+		if self.profile:
+			self.profile.Count("steps", n)
+			self.profile.Count("extraSteps", max(n - self.nSteps, 0)) # forced by the script being invalid
+	
+	def Instrument(self):
+		# time the parts of each step, by swapping in timed versions of these methods for this script only
+		self.ChooseSlot = self.profile.Timed("chooseSlot", self.ChooseSlot)
+		self.SampleSAO = self.profile.Timed("sampleSAO", self.SampleSAO)
+		self.RoleWeights = self.profile.Timed("roleWeights", self.RoleWeights)
+		fillSlot = self.profile.Timed("fillSlot", self.FillSlot)
+		def FillSlot(team, slot, candidates, roleWeights, sao=None):
+			self.profile.Size("candidates", len(candidates))
+			return fillSlot(team, slot, candidates, roleWeights, sao)
+		self.FillSlot = FillSlot
+	
+	def KeepStepping(self, n):
+		# called before each step, n is the number of steps done so far
+		if self.stop == "converged":
+			if n > 0 and n % self.window == 0:
+				self.RecordStats()
+			if not self.IsTheScriptActuallyBroken() and (n >= self.nSteps or self.Converged()):
+				return False
+		return (self.IsTheScriptActuallyBroken() or n < self.nSteps) and n < self.nSteps*2
+	
+	def RecordStats(self):
+		self.history.append((self.ScriptRoleAffinity(), self.ScriptSAOVariation(), self.nChanges / self.window))
+		self.nChanges = 0
+	
+	def Converged(self):
+		# the chain mixes quickly, so single snapshots are noisy: compare the mean of the last few snapshots with the mean of the few before them
+		if len(self.history) < 2*self.patience:
+			return False
+		history = np.array(self.history)
+		recent = np.mean(history[-self.patience:], axis=0)
+		previous = np.mean(history[-2*self.patience:-self.patience], axis=0)
+		return bool(np.all(np.abs(recent - previous) <= self.tolerance * np.maximum(np.abs(recent), 1)))
 			
 	def Step(self):
 		# Gibbs sampler step
-		
-		# choose which slot to resample & empty it
-		valid = False
-		for tries in range(20):
-			team = WeightedSampleFromDict(self.teamSizes)
-			pos = np.random.randint(0,len(self.script[team]))
-			valid = self.script[team][pos] not in self.requiredRoles
-		if not valid:
-			return		
-		self.script[team][pos] = ""
+		chosen = self.ChooseSlot()
+		if chosen is None:
+			return
+		team, slot = chosen
+		self.SetSlot(slot, -1)
 
-		# set role weights according to (sum of) adjacency to current roles
-		sao = WeightedSampleFromDict(self.data.saoDist) # filter by SAO dist if townsfolk
+		# set role weights according to adjacency to current roles
+		sao = self.SampleSAO(team)
+		candidates, roleWeights = self.RoleWeights(team)
+		self.FillSlot(team, slot, candidates, roleWeights, sao)
+		
+	def ChooseSlot(self):
+		# choose which slot to resample, None if 20 tries all landed on roles that have to stay
+		# a uniform slot is the same as a team weighted by team size, then a uniform slot within it
+		for slot in self.rng.integers(0, len(self.scriptIdx), 20):
+			if not self.IsPinned(self.scriptIdx[slot]):
+				return self.sampler.slotTeams[slot], slot
+		return None
+	
+	def IsPinned(self, roleIdx):
+		# required roles, and partners of on-script roles with hard restrictions, aren't resampled
+		if self.requiredMask[roleIdx]:
+			return True
+		return any(requiringIdx in self.scriptIdx for requiringIdx in self.data.requiredBy.get(roleIdx, []))
+		
+	def SampleSAO(self, team):
+		# SAO class to filter townsfolk candidates by, None for no filter
+		if team != "townsfolk" or not self.sampler.saoFilter:
+			return None
+		return self.sampler.saoSampler.Sample(self.rng)
+		
+	def FillSlot(self, team, slot, candidates, roleWeights, sao=None):
+		# sample a role for the empty slot, keeping within the jinx limit & the hard restrictions
+		# and within the SAO class, unless none of the allowed candidates are in it
+		allowed = self.AllowedCandidates(candidates)
+		if sao is not None:
+			inClass = allowed & self.data.saoMasks[sao][candidates]
+			if np.any(inClass):
+				allowed = inClass
+		roleIdx = self.SampleRole(team, candidates[allowed], roleWeights[allowed])
+		self.SetSlot(slot, roleIdx)
+		self.PlacePartners(roleIdx, slot)
+		
+	def AllowedCandidates(self, candidates):
+		# mask of candidates that don't take the script over the jinx limit (or add to it, if it's already over)
+		# and whose required partner is either on the script or can be placed alongside them
+		# a partner's jinxes count too, against the whole script, since we don't know yet which role it will replace
+		scriptIdx = self.scriptIdx[self.scriptIdx >= 0]
+		newJinxes = np.sum(self.data.jinxMatrix[np.ix_(candidates, scriptIdx)], axis=1)
+		for i,roleIdx in enumerate(candidates):
+			for requiredIdx in self.data.requires.get(roleIdx, []):
+				if requiredIdx in scriptIdx:
+					continue
+				if self.PartnerSlots(requiredIdx) is None:
+					newJinxes[i] = 6 # never allowed
+				else:
+					newJinxes[i] += np.sum(self.data.jinxMatrix[requiredIdx, scriptIdx]) + self.data.jinxMatrix[requiredIdx, roleIdx]
+		return (newJinxes == 0) | (self.nJinxes + newJinxes <= 5)
+	
+	def PartnerSlots(self, roleIdx, exclude=None):
+		# the slots where a partner could go, None if there are none
+		# exclude is the slot of the role that needs the partner, which mustn't be replaced by it
+		if self.omittedMask[roleIdx]:
+			return None
+		slots = [slot for slot in self.teamSlots[self.data.roleTeams[self.data.roles[roleIdx]]] if slot != exclude and self.scriptIdx[slot] >= 0 and not self.IsPinned(self.scriptIdx[slot])]
+		if len(slots) == 0:
+			return None
+		return slots
+	
+	def PlacePartners(self, roleIdx, slot):
+		# resample jointly: put in any partners that roleIdx (in slot) requires, in place of a random unpinned role of their team
+		for requiredIdx in self.data.requires.get(roleIdx, []):
+			if requiredIdx in self.scriptIdx:
+				continue
+			slots = self.PartnerSlots(requiredIdx, exclude=slot)
+			if slots is not None:
+				self.SetSlot(self.rng.choice(slots), requiredIdx)
+		
+	def SampleRole(self, team, candidates, roleWeights):
+		if np.sum(roleWeights) > 0:
+			return WeightedSampler(candidates, roleWeights).Sample(self.rng)
+		onScript = np.zeros(len(self.data.roles), dtype=bool)
+		onScript[self.scriptIdx[self.scriptIdx >= 0]] = True
+		fallback = np.flatnonzero(self.data.teamMasks[team] & ~onScript & ~self.omittedMask)
+		fallback = fallback[self.AllowedCandidates(fallback)]
+		if len(fallback) == 0:
+			fallback = np.flatnonzero(self.data.teamMasks[team] & ~onScript)
+		return self.rng.choice(fallback)
+		
+	def RoleWeightsVectorized(self, team):
+		# gamma'th percentile of the adjacency from on-script roles to each off-script candidate, column-wise
+		scriptIdx = self.scriptIdx[self.scriptIdx >= 0]
+		candidateMask = self.data.teamMasks[team] & ~self.omittedMask
+		candidateMask[scriptIdx] = False
+		candidates = np.flatnonzero(candidateMask)
+		if len(scriptIdx) == 0 or len(candidates) == 0:
+			return candidates, np.zeros(len(candidates))
+		w = np.percentile(self.data.roleAdjacency[scriptIdx][:, candidates], self.gamma*100, axis=0)
+		return candidates, self.alpha + w ** self.beta
+		
+	def RoleWeightsReference(self, team):
 		scriptRoles = self.ListRoles()
 		roleWeightsFull = {}
 		for role1 in scriptRoles:
@@ -265,67 +786,77 @@ class Script:
 			w = np.percentile(roleWeightsFull[role], self.gamma*100)
 			roleWeights[role] = self.alpha + w ** self.beta
 
-		if np.sum(list(roleWeights.values())) > 0:
-			newRole = WeightedSampleFromDict(roleWeights)
-		else:
-			newRole = np.random.choice(list(set(self.data.teams[team]) - set(scriptRoles)))
-		self.script[team][pos] = newRole				  
-
 		# debugging
 		#print(scriptRoles)
 		#print(json.dumps(roleWeights, indent=2, sort_keys=True))
 		
+		candidates = np.array([self.data.rolesInv[role] for role in roleWeights], dtype=int)
+		return candidates, np.array(list(roleWeights.values()))
+		
+	
+	def CountConstraints(self):
+		# running counts of jinxes & broken hard restrictions, kept up to date by SetSlot
+		scriptIdx = self.scriptIdx[self.scriptIdx >= 0]
+		self.nJinxes = int(np.sum(self.data.jinxMatrix[np.ix_(scriptIdx, scriptIdx)])) // 2
+		self.nBrokenRestrictions = 0
+		for roleIdx in scriptIdx:
+			for requiredIdx in self.data.requires.get(roleIdx, []):
+				if requiredIdx not in scriptIdx:
+					self.nBrokenRestrictions += 1
+	
+	def UpdateConstraints(self, roleIdx, sign):
+		# roleIdx is being added to (sign=1) or removed from (sign=-1) the roles currently in scriptIdx
+		others = self.scriptIdx[self.scriptIdx >= 0]
+		self.nJinxes += sign * int(np.sum(self.data.jinxMatrix[roleIdx, others]))
+		for requiredIdx in self.data.requires.get(roleIdx, []):
+			if requiredIdx not in others:
+				self.nBrokenRestrictions += sign
+		for requiringIdx in self.data.requiredBy.get(roleIdx, []):
+			if requiringIdx in others:
+				self.nBrokenRestrictions -= sign
+	
 	def IsTheScriptActuallyBroken(self):
-		scriptRoles = self.ListRoles()
-		for k,v in self.data.hardRestrictions.items():
-			if k in scriptRoles and v not in scriptRoles:
-				return True
-		if self.CountJinxes() > 5:
-			return True
-		return False
+		return self.nBrokenRestrictions > 0 or self.nJinxes > 5
 	
 	def CountJinxes(self):
-		nJinxes = 0
-		scriptRoles = self.ListRoles()
-		for (role1,role2) in self.data.jinxes:
-			if role1 in scriptRoles and role2 in scriptRoles:
-				nJinxes += 1
-		return nJinxes
+		return self.nJinxes
+	
+	def Scores(self):
+		# memoized on the script state, so the scores are cheap to ask for repeatedly (ID, logging, ranking)
+		key = (self.data.version, self.scriptIdx.tobytes())
+		if self.scoreKey != key:
+			self.scores = (self.ComputeRoleAffinity(), self.ComputeSAOVariation())
+			self.scoreKey = key
+		return self.scores
 	
 	def ScriptRoleAffinity(self):
+		return self.Scores()[0]
+	
+	def ScriptSAOVariation(self):
+		return self.Scores()[1]
+	
+	def ComputeRoleAffinity(self):
 		# normalized (to 1) average heatmap value between script roles
-		roleWeights = {}
-		scriptRoles = self.ListRoles()
-		for role1 in scriptRoles:
-			if not role1:
-				continue
-			for role2 in self.data.roles:
-				if role2 not in roleWeights:
-					roleWeights[role2] = self.alpha * np.median(self.data.roleAdjacency) 
-				roleWeights[role2] += self.data.roleAdjacency[self.data.rolesInv[role1],self.data.rolesInv[role2]]
-		return np.sum(list(roleWeights.values())) / len(scriptRoles) / np.median(self.data.roleAdjacency) / len(self.data.roleAdjacency)
+		filled = self.scriptIdx[self.scriptIdx >= 0]
+		if len(filled) == 0:
+			return 0.0
+		nRoles = len(self.data.roleAdjacency)
+		total = self.alpha * self.data.adjacencyMedian * nRoles + np.sum(self.data.adjacencyRowSums[filled])
+		return total / len(self.scriptIdx) / self.data.adjacencyMedian / nRoles
+	
+	def ScriptSAOCounts(self):
+		# saoClass -> number of townsfolk on the script
+		filled = self.scriptIdx[self.scriptIdx >= 0]
+		townsfolk = filled[self.data.teamMasks["townsfolk"][filled]]
+		return np.bincount(self.data.roleSAOIdx[townsfolk], minlength=len(self.data.saoFractions))
 	
 	def ScriptSAODist(self):
-		saoDist = {}
-		scriptRoles = self.ListRoles()
-		for role in scriptRoles:
-			if not role:
-				continue
-			if not self.data.roleTeams[role] == "townsfolk":
-				continue
-			saoClass = self.data.roleSAOs[role]
-			if saoClass not in saoDist:
-				saoDist[saoClass] = 0
-			saoDist[saoClass] += 1
-		return saoDist 
+		return {int(saoClass) : int(count) for saoClass,count in enumerate(self.ScriptSAOCounts()) if count > 0}
 		
-	def ScriptSAOVariation(self):
+	def ComputeSAOVariation(self):
 		# total variation of current SAO dist from data distribution
-		saoDist = self.ScriptSAODist()
-		n = max(max(saoDist.keys()), max(self.data.saoDist.keys()))+1 
-		v1 = np.array([saoDist.get(i,0) for i in range(n)]) / np.sum(list(saoDist.values()))
-		v2 = np.array([self.data.saoDist.get(i,0) for i in range(n)]) / np.sum(list(self.data.saoDist.values()))
-		return np.sum(np.abs(v1-v2))
+		saoCounts = self.ScriptSAOCounts()
+		return np.sum(np.abs(saoCounts / np.sum(saoCounts) - self.data.saoFractions))
 	
 	def SAOsort(self, roleList):
 		roleList = sorted(roleList)
@@ -351,7 +882,9 @@ class Script:
 		return s
 	
 	def ID(self):
-		return "%d_%d_%.1f_%.1f_%.1f_%.2f_%.2f" % (self.seed, self.nSteps, self.alpha, self.beta, self.gamma, self.ScriptRoleAffinity(), self.ScriptSAOVariation())
+		# a converged script is reproduced by stop="fixed" with its stepsUsed
+		steps = self.stepsUsed if self.stop == "converged" else self.nSteps
+		return "%d_%d_%.1f_%.1f_%.1f_%.2f_%.2f" % (self.seed, steps, self.alpha, self.beta, self.gamma, self.ScriptRoleAffinity(), self.ScriptSAOVariation())
 	
 	def ToolScript(self):
 		j = []
@@ -364,6 +897,25 @@ class Script:
 		# save in json format compatible with clocktower.online
 		with open("script_"+self.ID()+'.json', 'w') as f:
 			json.dump(self.ToolScript(), f)
-			
-	
-			   
\ No newline at end of file
+
+
+def ScriptScore(script):
+	# default GenerateBest ranking: invalid scripts last, then high affinity & low SAO variation
+	if script.IsTheScriptActuallyBroken():
+		return -np.inf
+	return script.ScriptRoleAffinity() - script.ScriptSAOVariation()
+
+workerData = None # Data, set once per ParallelGenerate worker process
+
+def InitWorker(inputData):
+	global workerData
+	workerData = inputData
+
+def GenerateInWorker(seeds, args):
+	teamSizes, steps, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter, stop, tolerance = args
+	scripts = Script.GenerateBatch(workerData, teamSizes, seeds, steps, alpha, beta, gamma, requiredRoles, omittedRoles, saoFilter, stop, tolerance)
+	return [(script.scriptIdx.copy(), script.stepsUsed) for script in scripts]
+
+if __name__ == '__main__':
+	# write the stats files for a data dir, e.g. python ScriptSampler.py public
+	Data(sys.argv[1] if len(sys.argv) > 1 else "public").UpdateStats()
@@ -1,5 +1,14 @@
+import os
+import re
+import glob
+import json
+import zlib
+import shutil
+import tempfile
+import threading
 import numpy as np
-from Script import Data, Script
+from ScriptSampler import Data, Script, ScriptScore
+from ScriptPdf import ScriptPdf, RenderBatch, PdfFile
 
 steps = 500 #np.random.randint(10**3,10**4)
 seed = np.random.randint(10**3,10**4)
@@ -14,8 +23,232 @@ teamSizes = {
 }
 
 inputData = Data("public")
-rolesRequired = ["pithag"]
+requiredRoles = ["pithag"]
 
-script = Script(inputData, teamSizes, seed=seed, steps=steps, alpha=alpha, beta=beta, rolesRequired=rolesRequired)
+def TestEnginesAgree():
+    # for fixed seeds, every engine must choose exactly the same roles as the reference step
+    for testSeed in range(5):
+        for kwargs in [{}, {"alpha":0.3, "beta":1.5, "gamma":0.3}, {"requiredRoles":["huntsman"], "omittedRoles":["imp"]}]:
+            reference = Script(inputData, teamSizes, seed=testSeed, steps=100, engine="reference", **kwargs)
+            for engine in ["vectorized"]:
+                script = Script(inputData, teamSizes, seed=testSeed, steps=100, engine=engine, **kwargs)
+                assert script.ListRoles() == reference.ListRoles(), (engine, testSeed, kwargs)
 
-print(script)
\ No newline at end of file
+def TestBatchAgrees():
+    # lockstep batch generation must give the same scripts as generating each seed on its own
+    seeds = list(range(10))
+    batch = Script.GenerateBatch(inputData, teamSizes, seeds, steps=100, requiredRoles=requiredRoles)
+    for testSeed,script in zip(seeds, batch):
+        assert script.ListRoles() == Script(inputData, teamSizes, seed=testSeed, steps=100, requiredRoles=requiredRoles).ListRoles(), testSeed
+
+def TestParallelAgrees():
+    # the process pool must not change the result, whatever the number of workers
+    seeds = list(range(10))
+    single = [Script(inputData, teamSizes, seed=testSeed, steps=100).ListRoles() for testSeed in seeds]
+    for maxWorkers in [1, 3]:
+        scripts = Script.ParallelGenerate(inputData, teamSizes, seeds, steps=100, maxWorkers=maxWorkers, batchSize=4)
+        assert [script.ListRoles() for script in scripts] == single, maxWorkers
+
+def TestUpdateStats():
+    # the stats files are all written, then left alone while the inputs are unchanged
+    with tempfile.TemporaryDirectory() as tmpDir:
+        path = os.path.join(tmpDir, "public")
+        shutil.copytree("public", path, ignore=shutil.ignore_patterns("stats", "data.npz"))
+        data = Data(path)
+        data.UpdateStats()
+        statsFiles = [os.path.join(path, "stats", f) for f in ["heatmap.png", "heatmap.xlsx", "sao.png", "inputs.sha256"]]
+        assert all(os.path.exists(f) for f in statsFiles)
+        times = [os.path.getmtime(f) for f in statsFiles]
+        data.UpdateStats()
+        assert [os.path.getmtime(f) for f in statsFiles] == times
+
+def TestConvergedStop():
+    # stopping early is the same as a fixed run of stepsUsed steps, and the batch stops each chain where it would stop alone
+    seeds = list(range(5))
+    batch = Script.GenerateBatch(inputData, teamSizes, seeds, steps=700, stop="converged")
+    for testSeed,script in zip(seeds, batch):
+        single = Script(inputData, teamSizes, seed=testSeed, steps=700, stop="converged")
+        assert script.stepsUsed == single.stepsUsed and script.ListRoles() == single.ListRoles(), testSeed
+        assert not single.IsTheScriptActuallyBroken()
+        assert single.ListRoles() == Script(inputData, teamSizes, seed=testSeed, steps=single.stepsUsed).ListRoles(), testSeed
+    # the tolerance reaches every chain, whichever way the batch is run
+    strict = [Script(inputData, teamSizes, seed=testSeed, steps=700, stop="converged", tolerance=0.05) for testSeed in seeds]
+    assert [script.stepsUsed for script in strict] != [script.stepsUsed for script in batch]
+    for scripts in [Script.GenerateBatch(inputData, teamSizes, seeds, steps=700, stop="converged", tolerance=0.05),
+                    Script.ParallelGenerate(inputData, teamSizes, seeds, steps=700, stop="converged", tolerance=0.05, maxWorkers=2, batchSize=2)]:
+        assert [script.stepsUsed for script in scripts] == [script.stepsUsed for script in strict]
+    best = max(strict, key=ScriptScore)
+    for maxWorkers in [1, 2]:
+        script = Script.GenerateBest(inputData, teamSizes, len(seeds), steps=700, stop="converged", tolerance=0.05, maxWorkers=maxWorkers, batchSize=2)
+        assert script.seed == best.seed and script.stepsUsed == best.stepsUsed, maxWorkers
+
+def TestPartnerPlacement():
+    # a role with a hard restriction keeps its slot, its partner replaces some other role, and the partner's jinxes count towards the limit
+    for role, partner in [("choirboy", "king"), ("huntsman", "damsel")]:
+        roleIdx, partnerIdx = inputData.rolesInv[role], inputData.rolesInv[partner]
+        for testSeed in range(100):
+            script = Script(inputData, teamSizes, seed=testSeed, build=False)
+            if script.IsTheScriptActuallyBroken() or roleIdx in script.scriptIdx or partnerIdx in script.scriptIdx:
+                continue
+            slot = next(slot for slot in script.teamSlots["townsfolk"] if not script.IsPinned(script.scriptIdx[slot]))
+            script.SetSlot(slot, -1)
+            candidates = np.flatnonzero(inputData.teamMasks["townsfolk"] & ~np.isin(np.arange(len(inputData.roles)), script.scriptIdx))
+            roleWeights = np.where(candidates == roleIdx, 1e6, np.where(candidates == partnerIdx, 0, 1.0))
+            script.FillSlot("townsfolk", slot, candidates, roleWeights)
+            assert script.scriptIdx[slot] != partnerIdx
+            if script.scriptIdx[slot] == roleIdx:
+                assert partnerIdx in script.scriptIdx
+            assert not script.IsTheScriptActuallyBroken()
+
+def TestGenerateBest():
+    # the best of n chains is the top scoring script of the batch, whether run here or in a pool
+    seeds = list(range(6))
+    batch = Script.GenerateBatch(inputData, teamSizes, seeds, steps=100)
+    best = max(batch, key=ScriptScore)
+    for maxWorkers in [1, 2]:
+        script = Script.GenerateBest(inputData, teamSizes, len(seeds), steps=100, maxWorkers=maxWorkers, batchSize=4)
+        assert script.seed == best.seed and script.ListRoles() == best.ListRoles(), maxWorkers
+    # a budget that has run out still gives the first batch
+    assert Script.GenerateBest(inputData, teamSizes, 64, steps=100, batchSize=2, budget=0).seed in [0, 1]
+
+def TestResolveRole():
+    # ids, display names & old names resolve exactly, anything else by fuzzy match (and is then cached)
+    assert inputData.ResolveRole("Fortune Teller") == "fortune_teller"
+    assert inputData.ResolveRole("fortuneteller") == "fortune_teller"
+    assert inputData.ResolveRole("mephit") == "mezepheles"
+    assert all(inputData.ResolveRole(role) == role for role in inputData.roles)
+    assert inputData.ResolveRole("scarlett woman") == "scarlet_woman"
+    assert "scarlett woman" in inputData.fuzzyCache
+
+def TestProfile():
+    # profiling records the steps taken, without changing the script
+    script = Script(inputData, teamSizes, seed=0, steps=100, profile=True)
+    assert script.ListRoles() == Script(inputData, teamSizes, seed=0, steps=100).ListRoles()
+    assert script.profile.counts["steps"] == script.stepsUsed
+    assert script.profile.sizes["candidates"][0] == script.stepsUsed
+    assert Script(inputData, teamSizes, seed=0, steps=100).profile is None
+
+def TestAddRemoveScripts():
+    # loading part of the corpus then adding the rest must match loading it all at once
+    scriptFiles = sorted(glob.glob(os.path.join("public", "scripts", "*.json")))
+    held = scriptFiles[::7]
+    with tempfile.TemporaryDirectory() as tmpDir:
+        shutil.copytree("public", os.path.join(tmpDir, "public"), ignore=shutil.ignore_patterns("stats", "data.npz"))
+        for f in held:
+            os.remove(os.path.join(tmpDir, "public", "scripts", os.path.basename(f)))
+        partData = Data(os.path.join(tmpDir, "public"), useCache=False)
+    data = partData.Copy()
+    script = Script(data, teamSizes, seed=0, steps=100)
+    partScores = script.Scores()
+    data.AddScripts(held)
+    assert np.array_equal(data.roleAdjacency, inputData.roleAdjacency)
+    assert data.saoDist == inputData.saoDist
+    # the scoring summaries (and so the memoized scores) follow the corpus
+    assert data.adjacencyMedian == inputData.adjacencyMedian
+    fullScript = Script(inputData, teamSizes, seed=0, steps=100, build=False)
+    fullScript.scriptIdx = script.scriptIdx.copy()
+    assert np.allclose(script.Scores(), fullScript.Scores())
+    data.RemoveScripts(held)
+    assert np.array_equal(data.roleAdjacency, partData.roleAdjacency)
+    assert data.saoDist == partData.saoDist
+    assert np.allclose(script.Scores(), partScores)
+
+def TestBadScripts():
+    # files that aren't a list of {"id" : role} are skipped, not fatal to AddScripts
+    data = inputData.Copy()
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fileNames = []
+        for i,text in enumerate(['{"id" : "imp"}', '[{"name" : "imp"}]', '[1, 2]', '[{"id" : "imp"']):
+            fileNames.append(os.path.join(tmpDir, "bad%d.json" % i))
+            with open(fileNames[-1], "w") as f:
+                f.write(text)
+        fileNames.append(os.path.join(tmpDir, "missing.json"))
+        data.AddScripts(fileNames)
+    assert np.array_equal(data.roleAdjacency, inputData.roleAdjacency)
+    assert data.scriptFiles == inputData.scriptFiles
+
+def TestPdfGeometry():
+    # single pass rendering must put everything where the old sizing run + render did, see UnitTestPdfGeometry.json
+    scriptPdf = ScriptPdf("public")
+    with open("UnitTestPdfGeometry.json") as f:
+        golden = json.load(f)
+    for case in golden:
+        assert PdfGeometry(bytes(scriptPdf.PdfAsBytes(case["toolScript"], case["name"]))) == case["geometry"], case["name"]
+
+def TestPdfCache():
+    # repeat renders come from the memory cache, or from cacheDir for a new ScriptPdf, and are the same pdf
+    toolScripts = [Script(inputData, teamSizes, seed=testSeed, steps=10).ToolScript() for testSeed in range(2)]
+    with tempfile.TemporaryDirectory() as cacheDir:
+        scriptPdf = ScriptPdf("public", cacheSize=1, cacheDir=cacheDir)
+        pdf0 = scriptPdf.PdfAsBytes(toolScripts[0], "Cached")
+        assert scriptPdf.PdfAsBytes(toolScripts[0], "Cached") == pdf0
+        assert scriptPdf.cacheStats == {"hits": 1, "diskHits": 0, "misses": 1, "evictions": 0}
+        scriptPdf.PdfAsBytes(toolScripts[1], "Cached")
+        assert scriptPdf.cacheStats["evictions"] == 1
+        assert scriptPdf.PdfAsBytes(toolScripts[0], "Cached") == pdf0
+        assert scriptPdf.cacheStats["diskHits"] == 1
+        otherPdf = ScriptPdf("public", cacheDir=cacheDir)
+        assert otherPdf.PdfAsBytes(toolScripts[0], "Cached") == pdf0
+        assert otherPdf.cacheStats["diskHits"] == 1 and otherPdf.cacheStats["misses"] == 0
+        assert otherPdf.PdfAsBytes(toolScripts[0], "Renamed") != pdf0
+        # concurrent writes of one key each go through their own temp file, the survivor is one whole pdf
+        payloads = [bytes([i]) * 100000 for i in range(8)]
+        threads = [threading.Thread(target=otherPdf.CachePdf, args=("racy", payload)) for payload in payloads]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        with open(os.path.join(cacheDir, "racy.pdf"), "rb") as f:
+            assert f.read() in payloads
+        assert all(fileName.endswith(".pdf") for fileName in os.listdir(cacheDir))
+
+def TestRenderBatch():
+    # a batch renders every script once, then skips them until a script changes
+    fileNames = sorted(glob.glob(os.path.join("public", "scripts", "*.json")))[:3]
+    with tempfile.TemporaryDirectory() as outDir:
+        assert RenderBatch(fileNames, outDir=outDir, maxWorkers=2) == 0
+        pdfFiles = [PdfFile(fileName, outDir) for fileName in fileNames]
+        assert all(os.path.exists(pdfFile) for pdfFile in pdfFiles)
+        times = [os.path.getmtime(pdfFile) for pdfFile in pdfFiles]
+        os.utime(pdfFiles[0], (0, 0)) # older than its script
+        assert RenderBatch(fileNames, outDir=outDir, maxWorkers=2) == 0
+        assert os.path.getmtime(pdfFiles[0]) > 0
+        assert [os.path.getmtime(pdfFile) for pdfFile in pdfFiles[1:]] == times[1:]
+    # only .json is stripped, and scripts that would still share a pdf are reported, not rendered
+    assert PdfFile("Full_Moon_Rising_v1.3.json", "out") != PdfFile("Full_Moon_Rising_v1.31.json", "out")
+    with tempfile.TemporaryDirectory() as tmpDir:
+        fileNames = [os.path.join(tmpDir, name) for name in ["A_B.json", "A B.json", "C.json"]]
+        for fileName in fileNames:
+            shutil.copy(os.path.join("public", "scripts", "Full_Moon_Rising_v1.3.json"), fileName)
+        assert RenderBatch(fileNames + fileNames[2:], maxWorkers=1) == 2
+        assert not os.path.exists(PdfFile(fileNames[0])) and os.path.exists(PdfFile(fileNames[2]))
+
+def PdfGeometry(pdfBytes):
+    # page sizes, then the numbers of every positioning op (rects, image placements, text positions) in drawing order
+    geometry = [m.decode() for m in re.findall(rb'/MediaBox \[[^\]]*\]', pdfBytes)]
+    for header,stream in re.findall(rb'obj\n<<(.*?)>>\nstream\n(.*?)\nendstream', pdfBytes, re.S):
+        if b'/Image' in header or b'/FlateDecode' not in header:
+            continue # only page content
+        content = zlib.decompress(stream)
+        geometry += [m.decode() for m in re.findall(rb'(?:-?[\d.]+ )+(?:re|cm|Td)\b', content)]
+    return geometry
+
+if __name__ == '__main__':
+    TestEnginesAgree()
+    TestBatchAgrees()
+    TestParallelAgrees()
+    TestConvergedStop()
+    TestUpdateStats()
+    TestPartnerPlacement()
+    TestGenerateBest()
+    TestResolveRole()
+    TestProfile()
+    TestPdfGeometry()
+    TestPdfCache()
+    TestRenderBatch()
+    TestAddRemoveScripts()
+    TestBadScripts()
+
+    script = Script(inputData, teamSizes, seed=seed, steps=steps, alpha=alpha, beta=beta, requiredRoles=requiredRoles)
+
+    print(script)